@@ -0,0 +1,226 @@
+import contextvars
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional
+
+from cache import DiskCache, get_page_cache, normalize_url
+from classifier import get_classifier
+from event_index import city_slug, get_event_index, resolve_date
+from fact_store import facts_prompt
+from metrics import count, register_source
+
+# Final answers to planning requests ("party in Köln today"), keyed by the
+# normalized intent: city, day, language, categories, topic words and the user's facts.
+#
+# Only the first message of a conversation is looked up, since later ones
+# depend on the history. Every answer keeps the evidence it relied on: the
+# pages read from the page cache and the event index lists of the categories
+# browsed. It expires at the end of the event day, as soon as one of those
+# pages or event lists changes, and when their cache entries are due for a
+# refresh (event lists after REFRESH_TTL), so it is never older than its evidence.
+
+# ANSWER_CACHE=0 turns the cache off, e.g. for load tests
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "1") != "0"
+MAX_BYTES = 20 * 1024 * 1024
+# Categories the classifier is less sure about than this are not part of the intent
+MIN_CONFIDENCE = 0.3
+# Answers that had side effects (or were made without all the evidence) are not reused
+UNCACHEABLE_TOOLS = {"StoreFact", "CreateICSEvent"}
+DEGRADED = re.compile(r"^Observation: \S+ (?:timed out after|was not run)")
+
+CITY = re.compile(r"\b(?:in|near|around|nach)\s+([A-ZÄÖÜ][\w-]+)")
+DAY = re.compile(r"\b(today|tonight|tomorrow|heute abend|heute|morgen|\d{4}-\d{2}-\d{2})\b", re.IGNORECASE)
+WORD = re.compile(r"\w+", re.UNICODE)
+# Words that do not change what is asked for
+STOPWORDS = {
+    "what", "can", "could", "i", "we", "do", "is", "are", "there", "any", "a", "an", "the", "in", "near", "around",
+    "to", "go", "for", "me", "us", "some", "something", "where", "find", "looking", "want", "would", "like", "of",
+    "and", "or", "event", "events", "activity", "activities", "things", "thing", "please", "this", "today",
+    "tonight", "tomorrow", "was", "kann", "ich", "wir", "machen", "gibt", "es", "eine", "einen", "ein", "der",
+    "die", "das", "nach", "heute", "abend", "morgen", "suche", "suchen", "und", "oder", "bitte", "etwas",
+}
+
+# Function words of the languages the agent is asked in, the answer is given in the same language
+LANGUAGE_WORDS = {
+    "en": {"the", "a", "an", "is", "are", "there", "what", "where", "can", "could", "i", "we", "me", "us", "to", "go",
+           "for", "some", "something", "any", "today", "tonight", "tomorrow", "and", "or", "of", "with", "near",
+           "around", "this", "weekend", "please", "looking", "want", "would", "like", "find", "do"},
+    "de": {"der", "die", "das", "ist", "sind", "gibt", "es", "was", "wo", "kann", "können", "ich", "wir", "mir", "uns",
+           "zu", "gehen", "für", "etwas", "heute", "morgen", "abend", "und", "oder", "mit", "bei", "nach", "diesem",
+           "wochenende", "bitte", "suche", "suchen", "möchte", "will", "ein", "eine", "einen", "machen"},
+}
+
+
+@dataclass(frozen=True)
+class Intent:
+    city: str
+    day: date
+    language: str
+    categories: tuple[str, ...]
+    topic: tuple[str, ...]
+    facts: str
+
+    @property
+    def key(self) -> str:
+        return "|".join([self.city, self.day.isoformat(), self.language, ",".join(self.categories) or "any",
+                         " ".join(self.topic) or "-", self.facts])
+
+
+def _stem(word: str) -> str:
+    return word[:-1] if len(word) > 3 and word.endswith("s") else word
+
+
+def detect_language(message: str) -> str:
+    '''
+    "en" or "de" by the function words of `message`, "unknown" if it is not clear.
+    '''
+    words = WORD.findall(message.lower())
+    counts = {language: sum(w in vocabulary for w in words) for language, vocabulary in LANGUAGE_WORDS.items()}
+    best = max(counts, key=counts.get)
+    return best if counts[best] > 0 and list(counts.values()).count(counts[best]) == 1 else "unknown"
+
+
+def answer_intent(message: str, user: Optional[str] = None) -> Optional[Intent]:
+    '''
+    The intent of `message`, or None if it does not name a city and a day.
+    '''
+    city, day = CITY.search(message), DAY.search(message)
+    if city is None or day is None:
+        return None
+    try:
+        when = resolve_date(day.group(1))
+    except ValueError:
+        return None
+    categories = tuple(sorted(c for c, confidence in get_classifier().classify(message, top_k=2)
+                              if confidence >= MIN_CONFIDENCE))
+    skip = STOPWORDS | set(WORD.findall(city.group(1).lower())) | set(WORD.findall(day.group(1).lower()))
+    topic = tuple(sorted({_stem(w) for w in WORD.findall(message.lower()) if w not in skip and not w.isdigit()}))
+    facts = hashlib.sha1(facts_prompt(message, user).encode("utf-8")).hexdigest()[:12]
+    return Intent(city_slug(city.group(1)), when, detect_language(message), categories, topic, facts)
+
+
+class Evidence:
+    '''
+    Pages and event lists a run read, collected by the tools through current_evidence.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pages: set[str] = set()
+        self.events: set[tuple[str, str, str]] = set()
+
+    def fingerprints(self) -> dict:
+        with self._lock:
+            pages, events = sorted(self.pages), sorted(self.events)
+        return {
+            "pages": {url: _page_version(url) for url in pages},
+            "events": {"|".join(key): _events_version(*key) for key in events},
+        }
+
+
+current_evidence: contextvars.ContextVar[Optional[Evidence]] = contextvars.ContextVar("current_evidence", default=None)
+
+
+def note_page(url: str):
+    evidence = current_evidence.get()
+    if evidence is not None:
+        with evidence._lock:
+            evidence.pages.add(normalize_url(url))
+
+
+def note_events(city: str, category: str, day: Optional[date]):
+    evidence = current_evidence.get()
+    if evidence is not None:
+        with evidence._lock:
+            evidence.events.add((city, category, day.isoformat() if day else ""))
+
+
+def _page_version(url: str) -> Optional[float]:
+    # A re-fetched page gets a new stored_at, a 304 revalidation keeps it. Peeked, so checking
+    # the evidence neither counts as a page cache hit nor keeps the page from being evicted
+    entry = get_page_cache().peek(url)
+    return entry.stored_at if entry is not None else None
+
+
+def _events_version(city: str, category: str, day: str) -> str:
+    records = get_event_index().query(city, category, date.fromisoformat(day) if day else None)
+    listing = [(r.name, r.url, r.date, r.time, r.venue, r.price) for r in records]
+    return hashlib.sha1(json.dumps(listing).encode("utf-8")).hexdigest()[:16]
+
+
+def unchanged(fingerprints: dict) -> bool:
+    '''
+    Whether the evidence is still what the answer was made from, and none of it is due for a refresh.
+    '''
+    for url, version in fingerprints["pages"].items():
+        entry = get_page_cache().peek(url)
+        if entry is None or not entry.fresh or entry.stored_at != version:
+            return False
+    index = get_event_index()
+    for key, version in fingerprints["events"].items():
+        city, category, day = key.split("|")
+        if index.is_stale(city, category) or _events_version(city, category, day) != version:
+            return False
+    return True
+
+
+def reusable(tool_calls: Iterable[tuple[str, str]]) -> bool:
+    '''
+    Whether an answer made with these (tool name, output) calls may be served again.
+    '''
+    return not any(name in UNCACHEABLE_TOOLS or DEGRADED.match(str(output)) for name, output in tool_calls)
+
+
+class AnswerCache:
+    def __init__(self, cache: Optional[DiskCache] = None):
+        self.cache = cache or DiskCache("answers", max_bytes=MAX_BYTES)
+        self.stats = {"hits": 0, "misses": 0, "invalidated": 0, "stored": 0}
+
+    def lookup(self, intent: Intent) -> Optional[dict]:
+        '''
+        The stored answer for `intent` ("answer", "reasoning", "tools", "stored_at"), if its evidence is unchanged.
+        '''
+        entry = self.cache.get(intent.key)
+        record = json.loads(entry.value) if entry is not None and entry.fresh else None
+        if record is not None and not unchanged(record["evidence"]):
+            self.cache.delete(intent.key)
+            self.stats["invalidated"] += 1
+            count("answer_cache.invalidated")
+            record = None
+        outcome = "hits" if record is not None else "misses"
+        self.stats[outcome] += 1
+        count(f"answer_cache.{outcome}")
+        return record
+
+    def store(self, intent: Intent, answer: str, reasoning: str, tools: str, evidence: Evidence):
+        # Without pages or events behind it nothing would ever invalidate the answer
+        if not (evidence.pages or evidence.events):
+            return
+        # Valid until the end of the day the events take place on
+        expires = datetime.combine(intent.day + timedelta(days=1), datetime.min.time()).timestamp()
+        ttl = expires - time.time()
+        if ttl <= 0:
+            return
+        record = {"answer": answer, "reasoning": reasoning, "tools": tools,
+                  "evidence": evidence.fingerprints(), "stored_at": time.time()}
+        self.cache.put(intent.key, json.dumps(record, ensure_ascii=False), ttl)
+        self.stats["stored"] += 1
+
+
+_answer_cache: Optional[AnswerCache] = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache()
+            register_source("answer_cache", lambda: dict(_answer_cache.stats))
+        return _answer_cache
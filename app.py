@@ -1,24 +1,38 @@
-from llama_index.core.memory import ChatMemoryBuffer
-from llama_index.core.agent.workflow import ReActAgent, AgentWorkflow, AgentStream, ToolCallResult
-from llama_index.core import PromptTemplate
-from llama_index.core.workflow import Context
-from llama_index.llms.openai import OpenAI
-from tools import search_tool, duckduckgo_tool, weather_tool, date_tool, summarize_webpage_tool, browse_rausgegangen_de_categories_tool, classify_query_tool, load_facts, store_fact_tool, create_ics_tool, more_information_tool
+from answer_cache import ANSWER_CACHE, Evidence, answer_intent, current_evidence, get_answer_cache, reusable
+from browser import shutdown_browser_pool
+from classifier import get_classifier
+from deadlines import start_turn, turn_expires
+from fact_store import DEFAULT_USER, current_user, facts_prompt
+from metrics import current_trace, span, start_metrics_server, start_trace
+from sessions import SessionManager
+from tools import AGENT_TOOLS, get_tools
 from dotenv import load_dotenv
-import gradio as gr
 import os
+import threading
+import time
 from datetime import datetime
-today = datetime.now().strftime("%Y-%m-%d")
+
+# Gradio and the llama_index agent stack take seconds to import. They are loaded
+# by the factories below when the UI or the first agent is built, so importing
+# this module (e.g. from the benchmarks) stays fast.
 
 load_dotenv()
 
-llm = OpenAI(model="gpt-4o")
+_llm = None
+_llm_lock = threading.Lock()
 
-# Import tools
-tools = [duckduckgo_tool(), summarize_webpage_tool(), weather_tool(), date_tool(), browse_rausgegangen_de_categories_tool(), classify_query_tool(), store_fact_tool(), create_ics_tool(), more_information_tool()]
+def get_llm():
+  global _llm
+  with _llm_lock:
+    if _llm is None:
+      from llama_index.llms.openai import OpenAI
+      _llm = OpenAI(model="gpt-4o")
+    return _llm
 
 #Init Memory
-memory = ChatMemoryBuffer.from_defaults(token_limit=40000)
+def new_memory():
+  from compact_memory import CompactMemory
+  return CompactMemory.from_defaults()
 
 # System_prompt
 react_header_prompt = """
@@ -68,23 +82,26 @@ Thought: I cannot answer the question with the provided tools.
 Answer: [your answer here (In the same language as the user's question)]
 ```
 """
-system_prompt = f"""
+rules_prompt = """
 ## Important Rules
 
 GENERAL BEHAVIOR:
 - If the user’s request is vague (e.g., no date or city), ask clarifying follow-up questions. 
 
 CURRENT DATE:
-- Today’s date is: {today}.
+- Today’s date is given under "Current Context" at the end of these instructions.
 - Always use the GetDate tool to confirm current date when uncertain.
 - Never assume today's date implicitly — reason only based on explicit values.
 
 TOOL USAGE RULES:
-- If you use duckduckgo_websearch or BrowseRausgegangenDeCategories, you MUST follow up with ExtractAndReadWebPage to extract page content.
+- If you use duckduckgo_websearch, you MUST follow up with ExtractAndReadWebPage to extract page content. To read several results, use ReadWebPages with all their URLs in one call instead of calling ExtractAndReadWebPage for each.
+- BrowseRausgegangenDeCategories already returns the events extracted from the category page (name, date, time, venue, price, url). Only use ExtractAndReadWebPage on the category page if it found no events.
+- Give ExtractAndReadWebPage a short query with what you are looking for (e.g. "events today time location price"), so it only returns the relevant passages.
 - Use classify_query_tool to choose a suitable category.
 - Use BrowseRausgegangenDeCategories for events in Germany. 
-- If no events are found in one category, try another. After two unsuccessful attempts, use websearch instead.
+- Browse several categories in one call: pass a list of categories, or category "auto" together with a query, to BrowseRausgegangenDeCategories. If that finds no events, use websearch instead.
 - NEVER answer based only on search result titles or URLs.
+- If a tool reports that it timed out, do not call it again with the same input. Try another source or answer with what you have.
 - Always use the weather tool if the request involves outdoor activities.
 - Store facts about the user using the StoreFact tool. These facts should help you to complete your task better and supply the user with more relevant information. Store facts like but not exclusivly: hometown, age, taste in activities, personal habits, social situation, etc. ALWAYS THINK ABOUT WHAT YOU CAN STORE ABOUT THE USER. Store information on your own, even if it not clearly stated as a fact.
 - Only Store one fact at a time. Do NEVER store a fact as a combination of information, like: "The User lives in city X and is free on Y". Use the StoreFact tool multiple times if needed.
@@ -105,11 +122,6 @@ FINAL ANSWER:
 
 If any of these are missing, say: “I could not find a confirmed event for today based on the available pages.”
 Your goal is to be **factual, cautious, and honest**.
-
-Here are some facts about the user based on previous interactions:
-
-{load_facts()}
-
 """
 
 examples ="""
@@ -137,11 +149,11 @@ Answer: Here are some Pubquiz events in Berlin today:
 1. Event 1: Pubquiz at Location A, Time: 19:00, Price: Free, Link: [Event 1](https://example.com/event1)
 2.
 
-If you dont find any events in the category, try another category:
-Thought: I could not find any Pubquiz events in the aktiv-und-kreativ category in Berlin for today. I will try the "nachtleben" category.
+If you are not sure about the category, browse several at once:
+Thought: Pubquizzes could be in aktiv-und-kreativ or nachtleben. I will search both categories in one call.
 Action: browse_rausgegangen_de_categories
-Action Input: {{{{"category": "nachtleben", "city": "Berlin", "date": "YYYY-MM-DD"}}}}
-Observation: Found 2 events in the nachtleben
+Action Input: {{{{"category": ["aktiv-und-kreativ", "nachtleben"], "city": "Berlin", "date": "YYYY-MM-DD", "query": "pubquiz"}}}}
+Observation: 5 events for aktiv-und-kreativ, nachtleben in Berlin on YYYY-MM-DD, best matches for 'pubquiz' first
 If the user ask for more information about the event, use the more_information_tool:
 
 If the user asks for an event that is not in the Rausgegangen.de categories, use the websearch tool:
@@ -150,81 +162,210 @@ Action: duckduckgo_websearch
 Action Input: {{"query": "Pubquiz in Berlin today"}}
 
 Example end
-
-## Current Conversation
-
-Below is the current conversation consisting of interleaving human and assistant messages.
-
 """
 
-# Define Agent
-agent = ReActAgent(
-    tools=tools,
-    llm=llm
-)
-
-react_system_prompt = PromptTemplate(react_header_prompt + system_prompt + examples)
-
-agent.update_prompts({'react_header': react_system_prompt})
-
-ctx = Context(agent)
-
-async def run_agent(message):
-  handler = agent.run(message, return_stream=True, ctx=ctx, memory=memory)
-  toughts, tool_calls, final = "", "", ""
-
-  async for ev in handler.stream_events():
-    if isinstance(ev, ToolCallResult):
-      tool_calls += f"🔧 {ev.tool_name}({ev.tool_kwargs}) => {ev.tool_output}\n\n"
-    elif isinstance(ev, AgentStream):
-      toughts += ev.delta
-
-  final_result = await handler
-  final += str(final_result)
-  return toughts.strip(), tool_calls.strip(), final.strip()
-
-
-with gr.Blocks(fill_height=True) as gradio_ui:
-  gr.Markdown("# Local Event Agent - Group 42")
-  with gr.Row():
-    chatbot = gr.Chatbot(type="messages", show_copy_button=True)
-    with gr.Column(visible=False) as right_column:
-      thoughts_box = gr.Textbox(label="🧠 Agent Thoughts", lines=8)
-      tools_box = gr.Textbox(label="🔧 Tool Calls", lines=8)
-      file_download = gr.File(label="📅 ICS-file", visible=False)
-
-  msg = gr.Textbox(label="Your message")
-  send_btn = gr.Button("Send")
-  toggle_btn = gr.Button("Toggle Debug View")
-
-
-  async def respond(user_input, chat_history):
-    thoughts, tools, final = await run_agent(user_input)
-    chat_history.append({"role": "user", "content": user_input})
-    chat_history.append({"role": "assistant", "content": final})
-    download_path = None
-    file_output = gr.update(value=None, visible=False)
-    if ".ics" in tools:
-      for line in tools.splitlines():
-        if ".ics" in line:
-          potential = line.split("=>")[-1].strip()
-          if os.path.exists(potential):
-            file_output = gr.update(value=potential, visible=True)
-            break
-
-    return chat_history, thoughts, tools, "", file_output
-
-
-  send_btn.click(fn=respond, inputs=[msg, chatbot], outputs=[chatbot, thoughts_box, tools_box, msg, file_download])
-  msg.submit(fn=respond, inputs=[msg, chatbot], outputs=[chatbot, thoughts_box, tools_box, msg, file_download])
-
-  # Keep track of visibility state
-  show_debug = gr.State(value=True)
-
-  def toggle_debug_view(show):
-    return gr.update(visible=not show), not show
-
-  toggle_btn.click(fn=toggle_debug_view, inputs=[show_debug], outputs=[right_column, show_debug])
+_prompt_builder = None
+_prompt_builder_lock = threading.Lock()
+
+def get_prompt_builder():
+  global _prompt_builder
+  with _prompt_builder_lock:
+    if _prompt_builder is None:
+      from prompts import PromptBuilder
+      # Static sections first so the prompt prefix stays the same; the date and the
+      # facts relevant to the current message come last
+      _prompt_builder = PromptBuilder(
+          [("instructions", react_header_prompt), ("rules", rules_prompt), ("examples", examples)],
+          volatile=["current_context"],
+      )
+    return _prompt_builder
+
+def turn_context(message):
+  facts = facts_prompt(message)
+  return get_prompt_builder().context(current_context=(
+      f"Today’s date is: {datetime.now():%Y-%m-%d (%A)}.\n\n"
+      f"Here are some facts about the user based on previous interactions that are relevant to the current message:\n{facts}\n\n"
+      "The current conversation follows as interleaving human and assistant messages."
+  ))
+
+# Define Agent, one per session so that per-turn settings do not leak between users
+def build_agent(llm=None):
+  from llama_index.core.agent.workflow import ReActAgent
+
+  agent = ReActAgent(
+      tools=get_tools(AGENT_TOOLS),
+      llm=llm or get_llm(),
+      formatter=get_prompt_builder().formatter("chat")
+  )
+  return agent
+
+sessions = SessionManager(build_agent, new_memory)
+
+# The chat is redrawn at most this often while an answer streams in
+FRAME_INTERVAL = 0.1
+
+def ics_path(tool_output):
+  path = str(tool_output).strip().removeprefix("Observation:").strip()
+  return path if path.endswith(".ics") and os.path.exists(path) else None
+
+async def run_agent(message, session, user=DEFAULT_USER):
+  '''
+  Async generator of (thoughts, tool_calls, reply, ics_file, timing) frames. `reply` is the
+  answer streamed so far, or what the agent is doing while there is none yet;
+  `timing` is the waterfall of the turn's steps, LLM and tool calls.
+  '''
+  from llama_index.core.agent.workflow import AgentStream, AgentOutput, ToolCall, ToolCallResult
+
+  async with session.lock:
+    trace, traced = start_trace()
+    # Repeated planning requests are answered from the cache. Only the first message of a
+    # conversation is looked up, later ones depend on what was said before.
+    intent = cached = None
+    try:
+      if ANSWER_CACHE and not session.memory.get_all():
+        intent = answer_intent(message, user)
+      if intent is not None:
+        with span("answer", "cache") as lookup:
+          cached = get_answer_cache().lookup(intent)
+          lookup.attrs["outcome"] = "hit" if cached is not None else "miss"
+    finally:
+      current_trace.reset(traced)
+    if cached is not None:
+      yield cached_reply(message, session, cached, trace)
+      return
+
+    # The agent's system prompt fills {context} with the date and the facts relevant to this message.
+    # The workflow copies the context variables when it starts, so the user is only set around run().
+    # The tool calls of this turn share TURN_DEADLINE seconds and add their spans to its trace
+    evidence = Evidence()
+    token, turn = current_user.set(user), start_turn()
+    traced, noted = current_trace.set(trace), current_evidence.set(evidence)
+    try:
+      session.agent.system_prompt = turn_context(message)
+      handler = session.agent.run(message, return_stream=True, ctx=session.ctx, memory=session.memory)
+    finally:
+      current_evidence.reset(noted)
+      current_trace.reset(traced)
+      turn_expires.reset(turn)
+      current_user.reset(token)
+
+    toughts, tool_calls, answer, status, ics_file = "", "", "", "🤔 Thinking...", None
+    timing = ""
+    last_frame = 0.0
+    used = []
+    try:
+      async for ev in handler.stream_events():
+        trace.on_event(ev)
+        urgent = False
+        if isinstance(ev, AgentStream):
+          toughts += ev.delta
+          if "Answer:" in ev.response:
+            answer = ev.response.split("Answer:", 1)[1].lstrip()
+        elif isinstance(ev, ToolCall):
+          status, urgent = f"🔧 Running {ev.tool_name}...", True
+        elif isinstance(ev, ToolCallResult):
+          tool_calls += f"🔧 {ev.tool_name}({ev.tool_kwargs}) => {ev.tool_output}\n\n"
+          used.append((ev.tool_name, str(ev.tool_output)))
+          status, urgent = "🤔 Thinking...", True
+          if ev.tool_name == "CreateICSEvent":
+            ics_file = ics_path(ev.tool_output) or ics_file
+        elif isinstance(ev, AgentOutput):
+          urgent = True
+        else:
+          continue
+        now = time.monotonic()
+        if urgent or now - last_frame >= FRAME_INTERVAL:
+          last_frame = now
+          if urgent:
+            timing = trace.waterfall()
+          yield toughts, tool_calls, answer or status, ics_file, timing
+
+      final = str(await handler)
+    finally:
+      trace.finish()
+      # The user left while the agent was still working
+      if not handler.done():
+        await handler.cancel_run()
+    if intent is not None and reusable(used):
+      # The finished reasoning, as the agent put it into the memory
+      reasoning = next((m.content for m in reversed(session.memory.get_all()) if m.role == "assistant"), final)
+      get_answer_cache().store(intent, final.strip(), reasoning, tool_calls.strip(), evidence)
+    yield toughts.strip(), tool_calls.strip(), final.strip(), ics_file, trace.waterfall()
+
+
+def cached_reply(message, session, cached, trace):
+  '''
+  The frame of an answer from the answer cache, which is added to the session's history as if the agent had given it.
+  '''
+  from llama_index.core.llms import ChatMessage
+
+  session.memory.put(ChatMessage(role="user", content=message))
+  session.memory.put(ChatMessage(role="assistant", content=cached["reasoning"]))
+  trace.finish()
+  stored = datetime.fromtimestamp(cached["stored_at"]).strftime("%H:%M")
+  thoughts = f"♻️ Same request as answered at {stored}, its evidence is unchanged.\n\n{cached['reasoning']}"
+  return thoughts, cached["tools"], f"{cached['answer']}\n\n♻️ _Cached answer from {stored}_", None, trace.waterfall()
+
+
+def sessions_status(session=None):
+  status = f"👥 Live sessions: {sessions.live} (stored on disk: {sessions.stored()})"
+  if session is not None:
+    status += f"\n\n🧾 History sent to the LLM: {session.memory.describe()}"
+    status += f"\n\n📏 Last prompt: {session.agent.formatter.describe()}"
+  return status
+
+
+def build_ui():
+  import gradio as gr
+
+  with gr.Blocks(fill_height=True) as gradio_ui:
+    gr.Markdown("# Local Event Agent - Group 42")
+    with gr.Row():
+      chatbot = gr.Chatbot(type="messages", show_copy_button=True)
+      with gr.Column(visible=False) as right_column:
+        thoughts_box = gr.Textbox(label="🧠 Agent Thoughts", lines=8)
+        tools_box = gr.Textbox(label="🔧 Tool Calls", lines=8)
+        timing_box = gr.Code(label="⏱️ Timing", language=None, lines=8, show_line_numbers=False)
+        file_download = gr.File(label="📅 ICS-file", visible=False)
+        sessions_box = gr.Markdown()
+
+    msg = gr.Textbox(label="Your message")
+    send_btn = gr.Button("Send")
+    toggle_btn = gr.Button("Toggle Debug View")
+
+
+    async def respond(user_input, chat_history, request: gr.Request):
+      session = sessions.get(request.session_hash or "default")
+      chat_history = chat_history + [{"role": "user", "content": user_input}, {"role": "assistant", "content": "🤔 Thinking..."}]
+      # Clear the textbox right away, the reply fills in as it is generated
+      yield chat_history, "", "", "", "", gr.update(value=None, visible=False), sessions_status()
+
+      async for thoughts, tools, reply, ics_file, timing in run_agent(user_input, session, request.username or DEFAULT_USER):
+        chat_history[-1] = {"role": "assistant", "content": reply}
+        file_output = gr.update(value=ics_file, visible=True) if ics_file else gr.update(value=None, visible=False)
+        yield chat_history, thoughts, tools, timing, "", file_output, sessions_status(session)
+
+
+    outputs = [chatbot, thoughts_box, tools_box, timing_box, msg, file_download, sessions_box]
+    send_btn.click(fn=respond, inputs=[msg, chatbot], outputs=outputs)
+    msg.submit(fn=respond, inputs=[msg, chatbot], outputs=outputs)
+
+    # Keep track of visibility state
+    show_debug = gr.State(value=True)
+
+    def toggle_debug_view(show):
+      return gr.update(visible=not show), not show
+
+    toggle_btn.click(fn=toggle_debug_view, inputs=[show_debug], outputs=[right_column, show_debug])
+  return gradio_ui
 
 if __name__ == "__main__":
-  gradio_ui.launch(inbrowser=True)
\ No newline at end of file
+  # Build the category classifier before the first user waits for it
+  get_classifier()
+  # Latency histograms as JSON on http://127.0.0.1:METRICS_PORT/metrics
+  start_metrics_server()
+  try:
+    build_ui().launch(inbrowser=True)
+  finally:
+    sessions.persist_all()
+    shutdown_browser_pool()
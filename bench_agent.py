@@ -0,0 +1,231 @@
+import argparse
+import asyncio
+import fnmatch
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from dotenv import load_dotenv
+
+from cassette import Cassette, git_revision, use_cassette
+from gaia_batch import load_questions, question_id
+
+# End-to-end benchmark of the agent on recorded traffic. Every scenario, a
+# GAIA question or an event planning dialogue, is recorded once against the
+# live LLM and websites into cassettes/<scenario>.json and then replayed
+# offline, each in a fresh process with empty caches, so runs can be compared
+# commit to commit.
+#
+#   python bench_agent.py record --scenarios "dialogue-*"
+#   python bench_agent.py replay --latency 1
+#   python bench_agent.py compare bench_results/abc1234.json bench_results/def5678.json
+
+DIALOGUES_FILE = "bench_dialogues.json"
+QUESTIONS_FILE = "gaia_questions.txt"
+CASSETTE_DIR = "cassettes"
+RESULTS_DIR = "bench_results"
+# Compared between runs, with the change in percent
+COMPARED = ("wall_time", "llm_calls", "tool_calls", "prompt_tokens", "completion_tokens")
+
+
+def load_scenarios() -> dict[str, dict]:
+    scenarios = {}
+    with open(DIALOGUES_FILE, "r", encoding="utf-8") as f:
+        for dialogue in json.load(f):
+            scenarios[f"dialogue-{dialogue['name']}"] = {"type": "dialogue", **dialogue}
+    for question in load_questions(QUESTIONS_FILE):
+        scenarios[f"gaia-{question_id(question)}"] = {"type": "gaia", "turns": [question]}
+    return scenarios
+
+
+def select(scenarios: dict[str, dict], patterns: list[str]) -> list[str]:
+    return [name for name in scenarios if not patterns or any(fnmatch.fnmatch(name, p) for p in patterns)]
+
+
+def cassette_path(name: str) -> str:
+    return os.path.join(CASSETTE_DIR, f"{name}.json")
+
+
+# One scenario, in the child process
+
+
+async def run_turns(scenario: dict, llm) -> list[float]:
+    from llama_index.core.workflow import Context
+
+    turns = []
+    if scenario["type"] == "gaia":
+        import gaia
+        from compact_memory import CompactMemory
+
+        agent = gaia.build_agent(llm)
+        started = time.perf_counter()
+        await gaia.run_agent(scenario["turns"][0], agent=agent, ctx=Context(agent), memory=CompactMemory.from_defaults())
+        return [time.perf_counter() - started]
+
+    import app
+    from sessions import Session
+
+    agent = app.build_agent(llm)
+    session = Session("bench", agent, Context(agent), app.new_memory())
+    for message in scenario["turns"]:
+        started = time.perf_counter()
+        async for _ in app.run_agent(message, session, scenario.get("user", "bench")):
+            pass
+        turns.append(time.perf_counter() - started)
+    return turns
+
+
+def run_scenario(name: str, scenario: dict, mode: str, latency: float) -> dict:
+    from llama_index.core.callbacks import CallbackManager, TokenCountingHandler
+    from llama_index.llms.openai import OpenAI
+
+    import metrics
+    from cassette import llm_clients
+    from tokens import encode
+
+    counter = TokenCountingHandler(tokenizer=encode)
+    llm = OpenAI(model="gpt-4o", callback_manager=CallbackManager([counter]), **llm_clients())
+    result = {"scenario": name}
+    started = time.perf_counter()
+    with use_cassette(Cassette(cassette_path(name), mode, latency)) as cassette:
+        try:
+            turns = asyncio.run(run_turns(scenario, llm))
+            result["turns"] = [round(seconds, 3) for seconds in turns]
+        except Exception as e:
+            result["error"] = repr(e)
+    result["wall_time"] = round(time.perf_counter() - started, 3)
+
+    latency_ms = metrics.snapshot()["latency"]
+    tools = {key.split(":", 1)[1]: h["count"] for key, h in latency_ms.items() if key.startswith("tool:")}
+    result["llm_calls"] = latency_ms.get("llm:llm", {}).get("count", 0)
+    result["tool_calls"] = sum(tools.values())
+    result["tools"] = tools
+    result["prompt_tokens"] = counter.prompt_llm_token_count
+    result["completion_tokens"] = counter.completion_llm_token_count
+    # Seconds spent per kind of span; fetches are part of the tool time
+    result["seconds_in"] = {kind: round(sum(h["mean_ms"] * h["count"] for key, h in latency_ms.items()
+                                            if key.startswith(kind + ":")) / 1000, 3)
+                            for kind in ("llm", "tool", "fetch")}
+    result["cassette"] = cassette.stats
+    return result
+
+
+# Driver
+
+
+def run_in_child(name: str, mode: str, latency: float) -> dict:
+    '''
+    Run scenario `name` in a new process with its own empty caches, fact store and logs.
+    '''
+    with tempfile.TemporaryDirectory(prefix="bench-") as tmp:
+        env = dict(os.environ, CACHE_DIR=os.path.join(tmp, "cache"), FACTS_DB=os.path.join(tmp, "facts.sqlite"),
+                   PROMPT_LOG=os.path.join(tmp, "prompt_tokens.jsonl"), METRICS_FILE=os.path.join(tmp, "metrics.json"),
+                   METRICS_PORT="0")
+        if mode == "replay":
+            env.setdefault("OPENAI_API_KEY", "replay")
+        command = [sys.executable, __file__, "scenario", name, "--mode", mode, "--latency", str(latency)]
+        process = subprocess.run(command, env=env, capture_output=True, text=True)
+    lines = process.stdout.strip().splitlines()
+    try:
+        return json.loads(lines[-1])
+    except (IndexError, ValueError):
+        return {"scenario": name, "error": f"exit code {process.returncode}: {process.stderr.strip()[-500:]}"}
+
+
+def print_result(result: dict):
+    if "error" in result:
+        print(f"{result['scenario']:<36} error: {result['error']}")
+        return
+    print(f"{result['scenario']:<36} {result['wall_time']:>8.2f} {result['llm_calls']:>5} {result['tool_calls']:>6} "
+          f"{result['prompt_tokens']:>8} {result['completion_tokens']:>7}  {result['cassette']['missed']} missed")
+
+
+def run(names: list[str], mode: str, latency: float, repeat: int) -> list[dict]:
+    print(f"{'scenario':<36} {'wall s':>8} {'llm':>5} {'tools':>6} {'prompt':>8} {'compl':>7}")
+    results = []
+    for name in names:
+        for _ in range(repeat):
+            result = run_in_child(name, mode, latency)
+            print_result(result)
+            results.append(result)
+    return results
+
+
+def summarize(results: list[dict]) -> dict[str, dict]:
+    '''
+    Mean of the compared values per scenario over its successful runs.
+    '''
+    runs: dict[str, list[dict]] = {}
+    for result in results:
+        if "error" not in result:
+            runs.setdefault(result["scenario"], []).append(result)
+    return {name: {key: sum(r[key] for r in rs) / len(rs) for key in COMPARED} for name, rs in runs.items()}
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    before, after = summarize(old["results"]), summarize(new["results"])
+    print(f"{old.get('revision')} → {new.get('revision')}")
+    print(f"{'scenario':<36} " + " ".join(f"{key:>22}" for key in COMPARED))
+    for name in sorted(set(before) & set(after)):
+        cells = []
+        for key in COMPARED:
+            a, b = before[name][key], after[name][key]
+            change = f"{(b - a) / a:+.0%}" if a else "n/a"
+            cells.append(f"{a:>8.6g} → {b:<8.6g}{change:>4}")
+        print(f"{name:<36} " + " ".join(f"{cell:>22}" for cell in cells))
+    for name in sorted(set(before) ^ set(after)):
+        print(f"{name:<36} only in {'the old' if name in before else 'the new'} results")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and replay agent scenarios and compare their performance.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="list the scenarios")
+    for command in ("record", "replay"):
+        sub = commands.add_parser(command, help=f"{command} scenarios")
+        sub.add_argument("--scenarios", nargs="*", default=[], help="name patterns, e.g. 'dialogue-*'")
+        sub.add_argument("--latency", type=float, default=0.0, help="replay the recorded latencies scaled by this factor")
+        sub.add_argument("--repeat", type=int, default=1)
+        sub.add_argument("--out", help=f"results file (default {RESULTS_DIR}/<revision>.json)")
+    scenario = commands.add_parser("scenario", help="run one scenario in this process and print its result")
+    scenario.add_argument("name")
+    scenario.add_argument("--mode", choices=["record", "replay"], default="replay")
+    scenario.add_argument("--latency", type=float, default=0.0)
+    diff = commands.add_parser("compare", help="compare two results files")
+    diff.add_argument("old")
+    diff.add_argument("new")
+    args = parser.parse_args()
+
+    load_dotenv()
+    scenarios = load_scenarios()
+    if args.command == "list":
+        for name, s in scenarios.items():
+            recorded = "recorded" if os.path.exists(cassette_path(name)) else "not recorded"
+            print(f"{name:<36} {len(s['turns'])} turns, {recorded}")
+    elif args.command == "scenario":
+        print(json.dumps(run_scenario(args.name, scenarios[args.name], args.mode, args.latency), ensure_ascii=False))
+    elif args.command == "compare":
+        compare(args.old, args.new)
+    else:
+        names = select(scenarios, args.scenarios)
+        if args.command == "replay":
+            names = [name for name in names if os.path.exists(cassette_path(name))]
+        results = run(names, args.command, args.latency, args.repeat)
+        revision = git_revision() or "unknown"
+        out = args.out or os.path.join(RESULTS_DIR, f"{revision}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump({"revision": revision, "mode": args.command, "latency": args.latency, "results": results},
+                      f, indent=2, ensure_ascii=False)
+        print(f"results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
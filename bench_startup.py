@@ -0,0 +1,72 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+# Import time of the entry points, measured with python -X importtime in a
+# fresh interpreter per module. Fails (exit code 1) when a module is over its
+# budget or eagerly imports one of the heavy dependencies, which are meant to
+# load on first use only.
+#
+#   python bench_startup.py
+#   python bench_startup.py --modules app --top 15
+
+# Seconds per module, with room for slower machines
+BUDGETS = {"tools": 0.4, "app": 0.5, "gaia": 0.5, "gaia_batch": 0.3, "bench_agent": 0.5}
+HEAVY = ("gradio", "llama_index.core", "llama_index.llms.openai", "openai", "playwright", "ddgs", "ics", "bs4", "lxml")
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def import_times(module: str) -> list[tuple[str, int, int, int]]:
+    '''
+    (name, depth, self µs, cumulative µs) of every module imported by `import module`.
+    '''
+    env = dict(os.environ)
+    # The LLM client is not created on import, but keep the check independent of .env
+    env.setdefault("OPENAI_API_KEY", "startup-benchmark")
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                             capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if process.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{process.stderr[-1000:]}")
+    rows = []
+    for line in process.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            rows.append((match.group(4), len(match.group(3)) // 2, int(match.group(1)), int(match.group(2))))
+    return rows
+
+
+def check(module: str, budget: float, top: int) -> bool:
+    rows = import_times(module)
+    end = next(i for i, (name, depth, _, _) in enumerate(rows) if name == module and depth == 0)
+    total = rows[end][3] / 1e6
+    # A module's imports are listed right before it
+    start = end
+    while start > 0 and rows[start - 1][1] > 0:
+        start -= 1
+    heavy = [h for h in HEAVY if any(name == h or name.startswith(h + ".") for name, *_ in rows)]
+    ok = total <= budget and not heavy
+    print(f"{module:<12} {total:>7.3f} s  budget {budget:.2f} s  {'ok' if ok else 'FAILED'}")
+    if heavy:
+        print(f"  imported eagerly: {', '.join(heavy)}")
+    # The direct imports of the module that cost the most
+    children = sorted((row for row in rows[start:end] if row[1] == 1), key=lambda row: row[3], reverse=True)[:top]
+    for name, _, _, cumulative in children:
+        print(f"  {cumulative / 1e6:>7.3f} s  {name}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of the entry points.")
+    parser.add_argument("--modules", nargs="+", default=list(BUDGETS))
+    parser.add_argument("--budget", type=float, help="seconds for every module instead of BUDGETS")
+    parser.add_argument("--top", type=int, default=5, help="slowest direct imports to show per module")
+    args = parser.parse_args()
+
+    results = [check(module, args.budget or BUDGETS.get(module, 0.5), args.top) for module in args.modules]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
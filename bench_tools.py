@@ -0,0 +1,77 @@
+import argparse
+import asyncio
+import statistics
+import time
+
+from concurrency import offload
+
+# Throughput of tool calls and event loop lag as the number of concurrent
+# sessions grows, for three ways of running a blocking tool:
+#   inline   - the sync function called on the event loop
+#   executor - llama_index's default for sync tools (loop's default executor)
+#   offload  - concurrency.offload with its bounded per-tool pool
+#
+#   python bench_tools.py --work 0.2 --calls 4 --sessions 1 2 4 8 16
+
+
+def blocking_tool(seconds: float) -> str:
+    # Stand-in for a page render or HTTP request
+    time.sleep(seconds)
+    return "Observation: done\n"
+
+
+async def lag_probe(samples: list[float], interval: float = 0.01):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+async def run_mode(mode: str, sessions: int, calls: int, work: float, tool_name: str) -> dict:
+    offloaded = offload(blocking_tool, tool_name)
+
+    async def call():
+        if mode == "inline":
+            return blocking_tool(work)
+        if mode == "executor":
+            return await asyncio.get_running_loop().run_in_executor(None, blocking_tool, work)
+        return await offloaded(work)
+
+    async def session():
+        for _ in range(calls):
+            await call()
+
+    lags: list[float] = []
+    probe = asyncio.create_task(lag_probe(lags))
+    start = time.perf_counter()
+    await asyncio.gather(*(session() for _ in range(sessions)))
+    elapsed = time.perf_counter() - start
+    probe.cancel()
+    lags.sort()
+    return {
+        "throughput": sessions * calls / elapsed,
+        "lag_p95_ms": lags[int(len(lags) * 0.95)] * 1000 if lags else elapsed * 1000,
+        "lag_max_ms": (lags[-1] if lags else elapsed) * 1000,
+        "lag_mean_ms": statistics.mean(lags) * 1000 if lags else elapsed * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark blocking vs offloaded tool execution.")
+    parser.add_argument("--work", type=float, default=0.2, help="seconds one tool call blocks")
+    parser.add_argument("--calls", type=int, default=4, help="tool calls per session")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--tool", default="ExtractAndReadWebPage", help="tool name whose concurrency limit applies")
+    parser.add_argument("--modes", nargs="+", default=["inline", "executor", "offload"])
+    args = parser.parse_args()
+
+    print(f"{'mode':<9} {'sessions':>8} {'calls/s':>9} {'lag p95 ms':>11} {'lag max ms':>11}")
+    for mode in args.modes:
+        for sessions in args.sessions:
+            result = asyncio.run(run_mode(mode, sessions, args.calls, args.work, args.tool))
+            print(f"{mode:<9} {sessions:>8} {result['throughput']:>9.1f} "
+                  f"{result['lag_p95_ms']:>11.1f} {result['lag_max_ms']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import asyncio
+import atexit
+import concurrent.futures
+import os
+import threading
+from typing import Any, Awaitable, Callable, Optional
+
+# Shared headless Chromium for all Playwright based tools.
+# Tools run in llama_index's executor threads and the sync Playwright API is
+# bound to the thread that started it, so the pool owns a private event loop
+# thread with the async Playwright API and tools submit jobs to it.
+
+MAX_PAGES = int(os.getenv("BROWSER_MAX_PAGES", "4"))
+RECYCLE_AFTER = int(os.getenv("BROWSER_RECYCLE_AFTER", "200"))
+HEADLESS = os.getenv("BROWSER_HEADLESS", "1") != "0"
+
+
+class BrowserPool:
+    '''
+    One warm Chromium process with a bounded number of concurrently open pages.
+    Every job gets a fresh browser context, so cookies do not leak between sessions.
+    The browser is restarted when it crashed or after `recycle_after` pages: from then
+    on no new pages are handed out until the pages in use are closed.
+    '''
+
+    def __init__(self, max_pages: int = MAX_PAGES, recycle_after: int = RECYCLE_AFTER, headless: bool = HEADLESS):
+        self.max_pages = max_pages
+        self.recycle_after = recycle_after
+        self.headless = headless
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._playwright = None
+        self._browser = None
+        self._browser_lock: Optional[asyncio.Lock] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._pages_served = 0
+        self._active = 0
+        self.stats = {"launches": 0, "pages": 0, "errors": 0}
+
+    # Event loop thread
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    self._browser_lock = asyncio.Lock()
+                    self._slots = asyncio.Semaphore(self.max_pages)
+                    self._idle = asyncio.Event()
+                    ready.set()
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=run, name="browser-pool", daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+            return self._loop
+
+    # Browser lifecycle (only called on the pool loop)
+
+    async def _get_browser(self):
+        '''
+        The browser for one more page, counted as in use until _release_page().
+        '''
+        async with self._browser_lock:
+            worn_out = self._pages_served >= self.recycle_after
+            if worn_out and self._active:
+                # Holding the lock keeps new jobs waiting until the pages in use are closed
+                self._idle.clear()
+                await self._idle.wait()
+            healthy = self._browser is not None and self._browser.is_connected()
+            if not healthy or worn_out:
+                await self._close_browser()
+                if self._playwright is None:
+                    from playwright.async_api import async_playwright
+                    self._playwright = await async_playwright().start()
+                self._browser = await self._playwright.chromium.launch(headless=self.headless)
+                self._pages_served = 0
+                self.stats["launches"] += 1
+            self._pages_served += 1
+            self._active += 1
+            return self._browser
+
+    def _release_page(self):
+        self._active -= 1
+        if self._active == 0:
+            self._idle.set()
+
+    async def _close_browser(self):
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception:
+                pass
+            self._browser = None
+
+    async def _run_job(self, job: Callable[[Any], Awaitable[Any]]):
+        async with self._slots:
+            browser = await self._get_browser()
+            context = None
+            try:
+                context = await browser.new_context()
+                page = await context.new_page()
+                return await job(page)
+            except Exception:
+                self.stats["errors"] += 1
+                raise
+            finally:
+                self.stats["pages"] += 1
+                if context is not None:
+                    try:
+                        await context.close()
+                    except Exception:
+                        pass
+                self._release_page()
+
+    async def _shutdown(self):
+        await self._close_browser()
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    # Public API
+
+    def run(self, job: Callable[[Any], Awaitable[Any]], timeout: Optional[float] = None):
+        '''
+        Run `async def job(page)` on a pooled page and return its result (blocking).
+        '''
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(self._run_job(job), loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            # Close the page instead of rendering on for nobody
+            future.cancel()
+            raise
+
+    def shutdown(self, timeout: float = 10):
+        if self._loop is None:
+            return
+        loop, self._loop = self._loop, None
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result(timeout)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(timeout)
+
+
+_pool: Optional[BrowserPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_browser_pool() -> BrowserPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool()
+        return _pool
+
+
+def shutdown_browser_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+atexit.register(shutdown_browser_pool)
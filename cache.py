@@ -0,0 +1,234 @@
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+
+from deadlines import DeadlineExceeded, time_left
+
+# Disk backed caches shared by all sessions (and processes) on this machine.
+
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+
+# Query parameters that never change the content of a page
+TRACKING_PARAMS = ("utm_", "fbclid", "gclid", "mc_cid", "mc_eid", "ref_src")
+
+
+def normalize_url(url: str) -> str:
+    '''
+    Canonical form of a URL: lower case scheme and host, no default port, no fragment,
+    no tracking parameters, sorted query and no trailing slash.
+    '''
+    url = url.strip()
+    if "://" not in url:
+        url = "https://" + url
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if parts.port and not (scheme, parts.port) in (("http", 80), ("https", 443)):
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip("/") or "/"
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if not k.lower().startswith(TRACKING_PARAMS)]
+    return urlunsplit((scheme, host, path, urlencode(sorted(query)), ""))
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    value: str
+    stored_at: float
+    expires_at: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+
+class DiskCache:
+    '''
+    Small key/value cache in a SQLite file with a TTL per entry and
+    least-recently-used eviction once the stored values exceed `max_bytes`.
+    Expired entries are kept until evicted, so callers can revalidate them.
+    '''
+
+    def __init__(self, name: str, max_bytes: int = 100 * 1024 * 1024, path: Optional[str] = None):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.path = path or os.path.join(CACHE_DIR, f"{name}.sqlite")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                etag TEXT,
+                last_modified TEXT
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+        self._db.commit()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "revalidated": 0, "evictions": 0}
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        '''
+        Return the entry for `key` (fresh or stale) or None.
+        '''
+        with self._lock:
+            row = self._db.execute(
+                "SELECT key, value, stored_at, expires_at, etag, last_modified FROM entries WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self._db.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        entry = CacheEntry(*row)
+        self.stats["hits" if entry.fresh else "stale"] += 1
+        return entry
+
+    def peek(self, key: str) -> Optional[CacheEntry]:
+        '''
+        Like get(), but without counting a hit or miss and without marking the entry as recently used.
+        '''
+        with self._lock:
+            row = self._db.execute(
+                "SELECT key, value, stored_at, expires_at, etag, last_modified FROM entries WHERE key = ?",
+                (key,),
+            ).fetchone()
+        return CacheEntry(*row) if row is not None else None
+
+    def put(self, key: str, value: str, ttl: float, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now + ttl, now, etag, last_modified),
+            )
+            self._evict()
+            self._db.commit()
+
+    def refresh(self, key: str, ttl: float):
+        '''
+        Mark a stale entry as fresh again, e.g. after a 304 Not Modified.
+        '''
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE entries SET expires_at = ?, accessed_at = ? WHERE key = ?", (now + ttl, now, key)
+            )
+            self._db.commit()
+        self.stats["revalidated"] += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._db.commit()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Free a bit more than necessary so that not every put evicts
+        target = self.max_bytes * 0.9
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall():
+            if total <= target:
+                break
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            self.stats["evictions"] += 1
+
+
+# Page cache
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# Time to live of extracted page text by domain (suffix match)
+DOMAIN_TTLS = {
+    "rausgegangen.de": 15 * MINUTE,
+    "wikipedia.org": 7 * DAY,
+    "wikimedia.org": 7 * DAY,
+}
+DEFAULT_TTL = 6 * HOUR
+
+_session = requests.Session()
+
+
+class PageCache(DiskCache):
+    '''
+    Extracted page text keyed by normalized URL, with per-domain TTLs and
+    ETag / Last-Modified revalidation of stale entries.
+    '''
+
+    def __init__(self, name: str = "pages", **kwargs):
+        super().__init__(name, **kwargs)
+
+    @staticmethod
+    def ttl_for(url: str) -> float:
+        host = urlsplit(normalize_url(url)).hostname or ""
+        for domain, ttl in DOMAIN_TTLS.items():
+            if host == domain or host.endswith("." + domain):
+                return ttl
+        return DEFAULT_TTL
+
+    def lookup(self, url: str) -> Optional[str]:
+        '''
+        Cached text for `url`, revalidating a stale entry with the origin if possible.
+        '''
+        entry = self.get(normalize_url(url))
+        if entry is None:
+            return None
+        if entry.fresh or self._revalidate(url, entry):
+            return entry.value
+        return None
+
+    def store(self, url: str, text: str, headers: Optional[dict] = None):
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        self.put(normalize_url(url), text, self.ttl_for(url),
+                 etag=headers.get("etag"), last_modified=headers.get("last-modified"))
+
+    def _revalidate(self, url: str, entry: CacheEntry) -> bool:
+        conditional = {}
+        if entry.etag:
+            conditional["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            conditional["If-Modified-Since"] = entry.last_modified
+        if not conditional:
+            return False
+        try:
+            with _session.get(url, headers=conditional, timeout=time_left(5), stream=True) as response:
+                not_modified = response.status_code == 304
+        except (requests.RequestException, DeadlineExceeded):
+            return False
+        if not_modified:
+            self.refresh(entry.key, self.ttl_for(url))
+        return not_modified
+
+
+_page_cache: Optional[PageCache] = None
+_page_cache_lock = threading.Lock()
+
+
+def get_page_cache() -> PageCache:
+    global _page_cache
+    with _page_cache_lock:
+        if _page_cache is None:
+            _page_cache = PageCache()
+        return _page_cache
@@ -0,0 +1,272 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Any, Callable, Iterator, Optional, TypeVar
+
+import httpx
+
+# Record and replay of everything the agent gets from the outside world: LLM
+# requests, page fetches, search results and weather forecasts.
+#
+# In "record" mode calls go out as usual and their results are written to a
+# cassette file; in "replay" mode they are served from it without network
+# access, optionally with the recorded latencies (scaled by `latency`).
+# Calls are matched by kind and key. Dates, times and weekdays in keys are masked, so
+# a cassette recorded yesterday still matches prompts and URLs built today, and
+# during replay current_date() is the day of the recording, so recorded pages
+# ("heute", "Sa, 24. Okt") resolve to the same events as back then.
+# Repeated calls with the same key get the recorded results in order.
+
+CASSETTE_VERSION = 1
+
+DATE = re.compile(r"\b\d{4}-\d{2}-\d{2}\b")
+CLOCK = re.compile(r"\b\d{1,2}:\d{2}:\d{2}\b")
+WEEKDAY = re.compile(r"\b(?:Monday|Tuesday|Wednesday|Thursday|Friday|Saturday|Sunday)\b")
+# Response headers worth keeping for the OpenAI client
+KEEP_HEADERS = ("content-type",)
+# Headers of the raw body, which no longer apply once it was read
+BODY_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+
+T = TypeVar("T")
+
+
+class CassetteMiss(LookupError):
+    '''
+    A replayed call that is not on the cassette.
+    '''
+
+
+class RecordedError(RuntimeError):
+    '''
+    Replay of a call that failed while recording.
+    '''
+
+
+def match_key(key: str) -> str:
+    return WEEKDAY.sub("<weekday>", CLOCK.sub("<time>", DATE.sub("<date>", key)))
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Cassette:
+    '''
+    Calls of one recording, by kind ("llm", "page", "search", "weather") and key.
+    '''
+
+    def __init__(self, path: str, mode: str = "replay", latency: float = 0.0):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"unknown cassette mode {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._entries: dict[str, dict[str, list[dict]]] = {}
+        self._played: dict[tuple[str, str], int] = {}
+        self.stats = {"recorded": 0, "replayed": 0, "missed": 0}
+        self.today = date.today()
+        if mode == "replay":
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != CASSETTE_VERSION:
+                raise ValueError(f"{path} is cassette version {data.get('version')}, expected {CASSETTE_VERSION}")
+            self._entries = data["entries"]
+            # Cassettes without "today" were saved on the day they were recorded
+            self.today = date.fromisoformat(data.get("today") or data["recorded_at"][:10])
+
+    def record(self, kind: str, key: str, entry: dict):
+        with self._lock:
+            self._entries.setdefault(kind, {}).setdefault(match_key(key), []).append(entry)
+            self.stats["recorded"] += 1
+
+    def play(self, kind: str, key: str) -> dict:
+        '''
+        The next recorded entry for `key`; the last one again once all were played.
+        '''
+        key = match_key(key)
+        with self._lock:
+            entries = self._entries.get(kind, {}).get(key)
+            if not entries:
+                self.stats["missed"] += 1
+                raise CassetteMiss(f"no recorded {kind} call for {key[:200]!r} in {self.path}")
+            n = self._played.get((kind, key), 0)
+            self._played[(kind, key)] = n + 1
+            self.stats["replayed"] += 1
+            return entries[min(n, len(entries) - 1)]
+
+    def delay(self, entry: dict) -> float:
+        return entry.get("seconds", 0.0) * self.latency
+
+    def call(self, kind: str, key: str, fn: Callable[[], T], encode: Callable[[T], Any] = lambda value: value,
+             decode: Callable[[Any], T] = lambda value: value) -> T:
+        '''
+        Result of `fn()`: recorded in record mode, from the cassette in replay mode.
+        '''
+        if self.mode == "replay":
+            entry = self.play(kind, key)
+            if self.latency:
+                time.sleep(self.delay(entry))
+            if "error" in entry:
+                raise RecordedError(entry["error"])
+            return decode(entry["value"])
+
+        started = time.perf_counter()
+        try:
+            value = fn()
+        except Exception as e:
+            self.record(kind, key, {"error": f"{type(e).__name__}: {e}", "seconds": round(time.perf_counter() - started, 3)})
+            raise
+        self.record(kind, key, {"value": encode(value), "seconds": round(time.perf_counter() - started, 3)})
+        return value
+
+    def save(self):
+        if self.mode != "record":
+            return
+        data = {
+            "version": CASSETTE_VERSION,
+            "recorded_at": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "today": self.today.isoformat(),
+            "entries": self._entries,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+_active: Optional[Cassette] = None
+
+
+@contextmanager
+def use_cassette(cassette: Cassette) -> Iterator[Cassette]:
+    '''
+    Route the hooked calls of the whole process through `cassette`, and save it afterwards.
+    '''
+    global _active
+    previous, _active = _active, cassette
+    try:
+        yield cassette
+    finally:
+        _active = previous
+        cassette.save()
+
+
+def current_date() -> date:
+    '''
+    Today, or the day the cassette was recorded while one is replayed.
+    '''
+    if _active is not None and _active.mode == "replay":
+        return _active.today
+    return date.today()
+
+
+def recorded(kind: str, key: str, fn: Callable[[], T], encode: Callable[[T], Any] = lambda value: value,
+             decode: Callable[[Any], T] = lambda value: value) -> T:
+    '''
+    `fn()`, or its recording while a cassette is in use. `encode` and `decode`
+    convert the result to and from JSON.
+    '''
+    if _active is None:
+        return fn()
+    return _active.call(kind, key, fn, encode, decode)
+
+
+# LLM requests: an httpx transport for the OpenAI client
+
+
+def request_key(request: httpx.Request) -> str:
+    body = request.content.decode("utf-8", errors="replace")
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, ensure_ascii=False)
+    except ValueError:
+        pass
+    return hashlib.sha1(match_key(f"{request.method} {request.url.path} {body}").encode("utf-8")).hexdigest()
+
+
+def _response(entry: dict, request: httpx.Request) -> httpx.Response:
+    if "error" in entry:
+        raise httpx.ConnectError(entry["error"], request=request)
+    value = entry["value"]
+    return httpx.Response(value["status"], headers=value["headers"], content=value["body"].encode("utf-8"), request=request)
+
+
+def _replayable(response: httpx.Response, body: bytes, request: httpx.Request) -> httpx.Response:
+    headers = [(k, v) for k, v in response.headers.items() if k.lower() not in BODY_HEADERS]
+    return httpx.Response(response.status_code, headers=headers, content=body, request=request)
+
+
+def _entry(response: httpx.Response, body: bytes, started: float) -> dict:
+    headers = {k: v for k, v in response.headers.items() if k.lower() in KEEP_HEADERS}
+    return {
+        "value": {"status": response.status_code, "headers": headers, "body": body.decode("utf-8")},
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+class CassetteTransport(httpx.BaseTransport):
+    '''
+    Sync transport that records the responses of `transport` (streamed bodies
+    are read to the end first) or replays them from the active cassette.
+    '''
+
+    def __init__(self, transport: Optional[httpx.BaseTransport] = None):
+        self.transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if _active is None:
+            return self.transport.handle_request(request)
+        if _active.mode == "replay":
+            entry = _active.play("llm", request_key(request))
+            time.sleep(_active.delay(entry))
+            return _response(entry, request)
+        started = time.perf_counter()
+        response = self.transport.handle_request(request)
+        body = response.read()
+        _active.record("llm", request_key(request), _entry(response, body, started))
+        return _replayable(response, body, request)
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    '''
+    Async counterpart of CassetteTransport.
+    '''
+
+    def __init__(self, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if _active is None:
+            return await self.transport.handle_async_request(request)
+        if _active.mode == "replay":
+            entry = _active.play("llm", request_key(request))
+            await asyncio.sleep(_active.delay(entry))
+            return _response(entry, request)
+        started = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        body = await response.aread()
+        _active.record("llm", request_key(request), _entry(response, body, started))
+        return _replayable(response, body, request)
+
+
+def llm_clients() -> dict:
+    '''
+    http_client and async_http_client arguments for llama_index's OpenAI LLM.
+    '''
+    return {
+        "http_client": httpx.Client(transport=CassetteTransport(), timeout=60),
+        "async_http_client": httpx.AsyncClient(transport=AsyncCassetteTransport(), timeout=60),
+    }
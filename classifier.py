@@ -0,0 +1,105 @@
+import json
+import math
+import re
+import threading
+from collections import Counter
+from typing import Optional
+
+# Local rausgegangen.de category classifier: character n-gram TF-IDF vectors of the
+# example event titles in example_categories.json, scored by cosine similarity to
+# the centroid of each category (or to the nearest examples with method="knn").
+
+EXAMPLES_FILE = "example_categories.json"
+NGRAMS = (2, 3, 4)
+TEMPERATURE = 0.05
+KNN_K = 5
+
+Vector = dict[str, float]
+
+
+def char_ngrams(text: str) -> Counter:
+    grams = Counter()
+    for word in re.findall(r"\w+", text.lower()):
+        padded = f" {word} "
+        for n in NGRAMS:
+            grams.update(padded[i:i + n] for i in range(max(len(padded) - n + 1, 1)))
+    return grams
+
+
+def _normalize(vector: Vector) -> Vector:
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    return {k: v / norm for k, v in vector.items()} if norm else {}
+
+
+def _cosine(a: Vector, b: Vector) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+
+class CategoryClassifier:
+    '''
+    Built once from {category: [example titles]}; classify() does no I/O.
+    '''
+
+    def __init__(self, examples: dict[str, list[str]], method: str = "centroid"):
+        self.method = method
+        # The category name itself ("food-und-drinks") is a useful example as well
+        self.labeled = [(category, title) for category, titles in examples.items()
+                        for title in [category.replace("-", " ")] + titles]
+        df = Counter()
+        counts = []
+        for _, title in self.labeled:
+            grams = char_ngrams(title)
+            counts.append(grams)
+            df.update(grams.keys())
+        n = len(counts)
+        self.idf = {gram: math.log((1 + n) / (1 + freq)) + 1 for gram, freq in df.items()}
+        self.vectors = [self.vectorize_counts(grams) for grams in counts]
+        self.centroids: dict[str, Vector] = {}
+        for category in examples:
+            total = Counter()
+            for (label, _), vector in zip(self.labeled, self.vectors):
+                if label == category:
+                    total.update(vector)
+            self.centroids[category] = _normalize(dict(total))
+
+    @classmethod
+    def from_file(cls, path: str = EXAMPLES_FILE, **kwargs) -> "CategoryClassifier":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f), **kwargs)
+
+    def vectorize_counts(self, grams: Counter) -> Vector:
+        return _normalize({g: (1 + math.log(c)) * self.idf[g] for g, c in grams.items() if g in self.idf})
+
+    def similarities(self, query: str) -> dict[str, float]:
+        vector = self.vectorize_counts(char_ngrams(query))
+        if self.method == "knn":
+            best: dict[str, list[float]] = {category: [] for category in self.centroids}
+            for (category, _), example in zip(self.labeled, self.vectors):
+                best[category].append(_cosine(vector, example))
+            return {c: sum(sorted(s, reverse=True)[:KNN_K]) / KNN_K for c, s in best.items()}
+        return {category: _cosine(vector, centroid) for category, centroid in self.centroids.items()}
+
+    def classify(self, query: str, top_k: int = 3) -> list[tuple[str, float]]:
+        '''
+        The `top_k` categories with a confidence (softmax over the similarities).
+        '''
+        sims = self.similarities(query)
+        top = max(sims.values())
+        weights = {c: math.exp((s - top) / TEMPERATURE) for c, s in sims.items()}
+        total = sum(weights.values())
+        ranked = sorted(weights.items(), key=lambda item: item[1], reverse=True)
+        return [(category, weight / total) for category, weight in ranked[:top_k]]
+
+
+_classifier: Optional[CategoryClassifier] = None
+_classifier_lock = threading.Lock()
+
+
+def get_classifier() -> CategoryClassifier:
+    global _classifier
+    with _classifier_lock:
+        if _classifier is None:
+            _classifier = CategoryClassifier.from_file()
+        return _classifier
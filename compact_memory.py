@@ -0,0 +1,109 @@
+import re
+from functools import lru_cache
+from typing import Any, List, Optional
+
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.memory import ChatMemoryBuffer
+from pydantic import PrivateAttr
+
+from observations import digest_observation
+from tokens import encode
+
+# Chat memory that keeps the prompt small as the conversation grows: the
+# ReAct agent stores each turn's reasoning, tool observations included, as one
+# assistant message. Observations of older turns are replaced by digests.
+
+TOKEN_LIMIT = 12000
+# The current turn and the one before it are sent verbatim
+KEEP_TURNS = 2
+
+# An observation runs until the next reasoning step
+OBSERVATION = re.compile(r"^Observation: (?:Observation: )?(.*?)(?=^(?:Thought|Action|Answer):|\Z)", re.MULTILINE | re.DOTALL)
+
+
+@lru_cache(maxsize=2048)
+def compact_reasoning(content: str) -> str:
+    '''
+    The reasoning of a turn with every observation digested.
+    '''
+    def digest(match: re.Match) -> str:
+        body = match.group(1).rstrip()
+        return "Observation: " + digest_observation(body) + match.group(1)[len(body):]
+
+    return OBSERVATION.sub(digest, content)
+
+
+class CompactMemory(ChatMemoryBuffer):
+    '''
+    Sends the last `keep_turns` turns verbatim and older tool observations as
+    digests. If that is still over `token_limit`, recent observations are
+    digested as well, and only then are the oldest messages dropped.
+    The full history stays in the chat store.
+    '''
+
+    keep_turns: int = KEEP_TURNS
+    _last_report: dict = PrivateAttr(default_factory=dict)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CompactMemory"
+
+    @classmethod
+    def from_defaults(cls, chat_history: Optional[List[ChatMessage]] = None, token_limit: int = TOKEN_LIMIT,
+                      keep_turns: int = KEEP_TURNS, **kwargs: Any) -> "CompactMemory":
+        memory = cls(token_limit=token_limit, tokenizer_fn=encode, keep_turns=keep_turns, **kwargs)
+        if chat_history:
+            memory.set(chat_history)
+        return memory
+
+    @staticmethod
+    def _compact(message: ChatMessage) -> ChatMessage:
+        if message.role != MessageRole.ASSISTANT or "Observation:" not in (message.content or ""):
+            return message
+        content = compact_reasoning(message.content)
+        return message if content == message.content else ChatMessage(role=message.role, content=content)
+
+    def get(self, input: Optional[str] = None, initial_token_count: int = 0, **kwargs: Any) -> List[ChatMessage]:
+        history = self.get_all()
+        limit = self.token_limit - initial_token_count
+        before = self._token_count_for_messages(history)
+
+        users = [i for i, m in enumerate(history) if m.role == MessageRole.USER]
+        recent = users[-self.keep_turns] if len(users) >= self.keep_turns else 0
+        messages = [self._compact(m) for m in history[:recent]] + history[recent:]
+        if self._token_count_for_messages(messages) > limit:
+            messages = [self._compact(m) for m in messages]
+
+        dropped = 0
+        while messages and self._token_count_for_messages(messages) > limit:
+            # The history has to start with a user message
+            messages = messages[1:]
+            dropped += 1
+            while messages and messages[0].role in (MessageRole.ASSISTANT, MessageRole.TOOL):
+                messages = messages[1:]
+                dropped += 1
+
+        self._last_report = {
+            "messages": len(history),
+            "dropped": dropped,
+            "tokens_before": before,
+            "tokens_after": self._token_count_for_messages(messages),
+            "token_limit": self.token_limit,
+        }
+        return messages
+
+    @property
+    def last_report(self) -> dict:
+        '''
+        Messages and tokens of the history before and after the last get().
+        '''
+        return dict(self._last_report)
+
+    def describe(self) -> str:
+        report = self._last_report
+        if not report:
+            return "no history sent yet"
+        text = f"{report['tokens_before']} → {report['tokens_after']} tokens of {report['messages']} messages"
+        if report["dropped"]:
+            text += f", {report['dropped']} oldest dropped"
+        return text
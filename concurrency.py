@@ -0,0 +1,92 @@
+import asyncio
+import contextvars
+import functools
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from deadlines import DeadlineExceeded, current_deadline, tool_deadline
+from metrics import span
+from observations import observation
+
+# Runs the blocking tool functions on a bounded thread pool so that the event
+# loop (and every other session on it) keeps going while a tool waits on the
+# browser, the network or the disk.
+
+MAX_WORKERS = int(os.getenv("TOOL_WORKERS", "32"))
+
+# Calls of one tool that may run at the same time
+TOOL_LIMITS = {
+    "ExtractAndReadWebPage": 4,
+    "ReadWebPages": 2,
+    "Extract_Event_URL": 2,
+    "BrowseRausgegangenDeCategories": 4,
+    "duckduckgo_websearch": 4,
+    "GetWeather": 8,
+    "StoreFact": 2,
+    "CreateICSEvent": 2,
+}
+DEFAULT_LIMIT = 4
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="tools")
+# asyncio semaphores belong to one event loop
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+
+
+def _semaphore(name: str) -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    per_loop = _semaphores.setdefault(loop, {})
+    if name not in per_loop:
+        per_loop[name] = asyncio.Semaphore(TOOL_LIMITS.get(name, DEFAULT_LIMIT))
+    return per_loop[name]
+
+
+def _release(loop: asyncio.AbstractEventLoop, semaphore: asyncio.Semaphore):
+    # Called on the worker thread, asyncio semaphores are only safe to use on their loop
+    if not loop.is_closed():
+        loop.call_soon_threadsafe(semaphore.release)
+
+
+def timed_out(name: str, seconds: float) -> str:
+    return observation(f"{name} timed out after {seconds:.1f} s. Try another source or answer with what you have.", name)
+
+
+def offload(fn: Callable[..., Any], name: str) -> Callable[..., Any]:
+    '''
+    Async version of the blocking `fn` for FunctionTool(async_fn=...): runs on the
+    tool thread pool with at most TOOL_LIMITS[name] calls in flight. Context
+    variables (e.g. fact_store.current_user) are passed on to the thread.
+    Every call has a deadline (see deadlines.py); when it passes, the call is
+    cancelled and a "timed out" observation is returned instead. Calls are
+    timed as "tool" spans (see metrics.py).
+    '''
+    @functools.wraps(fn)
+    async def run(*args, **kwargs):
+        deadline = tool_deadline(name)
+        if deadline.expired:
+            return observation(f"{name} was not run, the time for this turn is used up. Answer with what you have.", name)
+        with span(name, "tool", input_chars=len(repr(args)) + len(repr(kwargs))) as s:
+            try:
+                # Waiting for a free slot counts against the deadline, too
+                result = await asyncio.wait_for(_run(deadline, *args, **kwargs), deadline.remaining())
+            except (asyncio.TimeoutError, DeadlineExceeded):
+                deadline.cancel()
+                s.attrs["timed_out"] = True
+                result = timed_out(name, deadline.seconds)
+            s.attrs["output_chars"] = len(str(result))
+            return result
+
+    async def _run(deadline, *args, **kwargs):
+        semaphore = _semaphore(name)
+        await semaphore.acquire()
+        context = contextvars.copy_context()
+        context.run(current_deadline.set, deadline)
+        loop = asyncio.get_running_loop()
+        future = _executor.submit(context.run, fn, *args, **kwargs)
+        # The slot is freed when the thread is done, not at the deadline: a call that
+        # timed out keeps its thread busy until it notices, and still counts against the limit
+        future.add_done_callback(lambda _: _release(loop, semaphore))
+        return await asyncio.wrap_future(future)
+
+    return run
@@ -0,0 +1,193 @@
+import contextvars
+import os
+import random
+import threading
+import time
+from typing import Callable, Optional, TypeVar
+from urllib.parse import urlsplit
+
+# Time budgets for tool calls and chat turns, retries of idempotent requests
+# and per-host circuit breakers.
+#
+# offload() gives every tool call a Deadline (the tool's budget, capped by what
+# is left of the turn) in a context variable. Code doing network or browser work
+# asks time_left() for its timeouts, so in-flight requests end when the budget
+# does, and stops early once the call was cancelled.
+
+# Seconds per call, by tool name
+TOOL_DEADLINES = {
+    "ExtractAndReadWebPage": 25,
+    "ReadWebPages": 35,
+    "Extract_Event_URL": 20,
+    "BrowseRausgegangenDeCategories": 30,
+    "duckduckgo_websearch": 15,
+    "GetWeather": 8,
+}
+DEFAULT_DEADLINE = float(os.getenv("TOOL_DEADLINE", "20"))
+TURN_DEADLINE = float(os.getenv("TURN_DEADLINE", "120"))
+
+RETRIES = 2
+RETRY_BASE_DELAY = 0.3
+BREAKER_FAILURES = 5
+BREAKER_RESET = 60
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class CircuitOpen(ConnectionError):
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+        self._cancelled = threading.Event()
+
+    def remaining(self) -> float:
+        if self._cancelled.is_set():
+            return 0.0
+        return max(0.0, self.expires - time.monotonic())
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+current_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("current_deadline", default=None)
+# Absolute time.monotonic() at which the current chat turn has to be done
+turn_expires: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("turn_expires", default=None)
+
+
+def start_turn(seconds: float = TURN_DEADLINE) -> contextvars.Token:
+    return turn_expires.set(time.monotonic() + seconds)
+
+
+def tool_deadline(name: str) -> Deadline:
+    '''
+    Deadline of a new call of tool `name`: its own budget or the rest of the turn, whichever is shorter.
+    '''
+    seconds = TOOL_DEADLINES.get(name, DEFAULT_DEADLINE)
+    expires = turn_expires.get()
+    if expires is not None:
+        seconds = min(seconds, max(0.0, expires - time.monotonic()))
+    return Deadline(seconds)
+
+
+def time_left(default: float) -> float:
+    '''
+    Timeout for the next blocking step: `default`, or less if the current deadline is closer.
+    Raises DeadlineExceeded when the deadline has passed or the call was cancelled.
+    '''
+    deadline = current_deadline.get()
+    if deadline is None:
+        return default
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded(f"deadline of {deadline.seconds:.0f} s exceeded")
+    return min(default, remaining)
+
+
+class CircuitBreaker:
+    '''
+    Opens after `failures` failures in a row and then fails fast for `reset_after`
+    seconds. After that one trial call is let through; it closes the breaker again
+    on success and re-opens it on failure.
+    '''
+
+    def __init__(self, failures: int = BREAKER_FAILURES, reset_after: float = BREAKER_RESET):
+        self.failures = failures
+        self.reset_after = reset_after
+        self._lock = threading.Lock()
+        self._count = 0
+        self._opened_at: Optional[float] = None
+        self._trial = False
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_after or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._count, self._opened_at, self._trial = 0, None, False
+
+    def release(self):
+        # The trial call ended with an error that says nothing about the host, let the next call try
+        with self._lock:
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._count += 1
+            if self._trial or self._count >= self.failures:
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self._opened_at >= self.reset_after else "open"
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(url_or_host: str) -> CircuitBreaker:
+    host = urlsplit(url_or_host).hostname or url_or_host
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker()
+        return _breakers[host]
+
+
+def open_circuits() -> list[str]:
+    with _breakers_lock:
+        breakers = list(_breakers.items())
+    return [host for host, breaker in breakers if breaker.state != "closed"]
+
+
+def retrying(call: Callable[[], T], url_or_host: str, retry_on: tuple = (ConnectionError, TimeoutError),
+             attempts: int = RETRIES + 1) -> T:
+    '''
+    Run the idempotent `call` with up to `attempts` tries and exponential backoff with
+    jitter, guarded by the host's circuit breaker. Only `retry_on` errors are retried
+    and count as host failures; retries stop when the current deadline would pass.
+    '''
+    breaker = get_breaker(url_or_host)
+    for attempt in range(attempts):
+        if not breaker.allow():
+            raise CircuitOpen(f"{urlsplit(url_or_host).hostname or url_or_host} failed repeatedly, not trying again for now")
+        try:
+            result = call()
+        except DeadlineExceeded:
+            breaker.release()
+            raise
+        except retry_on:
+            breaker.failure()
+            delay = RETRY_BASE_DELAY * 2 ** attempt * random.uniform(0.5, 1.5)
+            deadline = current_deadline.get()
+            if attempt + 1 == attempts or (deadline is not None and deadline.remaining() <= delay):
+                raise
+            time.sleep(delay)
+        except BaseException:
+            # Not a host failure (e.g. an HTTP error status), but it must not keep the trial slot
+            breaker.release()
+            raise
+        else:
+            breaker.success()
+            return result
@@ -0,0 +1,58 @@
+import argparse
+import json
+import random
+import time
+
+from classifier import EXAMPLES_FILE, CategoryClassifier
+
+# Accuracy of the local category classifier on held-out example titles.
+#
+#   python evaluate_classifier.py --holdout 0.2 --rounds 20
+#   python evaluate_classifier.py --method knn
+
+
+def split(examples: dict[str, list[str]], holdout: float, rng: random.Random):
+    train, test = {}, []
+    for category, titles in examples.items():
+        titles = titles[:]
+        rng.shuffle(titles)
+        n_test = max(1, round(len(titles) * holdout))
+        train[category] = titles[n_test:]
+        test += [(category, title) for title in titles[:n_test]]
+    return train, test
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the category classifier on held-out examples.")
+    parser.add_argument("--examples", default=EXAMPLES_FILE)
+    parser.add_argument("--holdout", type=float, default=0.2, help="fraction of each category held out")
+    parser.add_argument("--rounds", type=int, default=20, help="number of random splits")
+    parser.add_argument("--method", choices=["centroid", "knn"], default="centroid")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with open(args.examples, "r", encoding="utf-8") as f:
+        examples = json.load(f)
+
+    rng = random.Random(args.seed)
+    top1 = top3 = total = 0
+    seconds = 0.0
+    for _ in range(args.rounds):
+        train, test = split(examples, args.holdout, rng)
+        classifier = CategoryClassifier(train, method=args.method)
+        for category, title in test:
+            start = time.perf_counter()
+            ranked = [c for c, _ in classifier.classify(title)]
+            seconds += time.perf_counter() - start
+            top1 += ranked[0] == category
+            top3 += category in ranked
+            total += 1
+
+    print(f"method: {args.method}, {args.rounds} rounds, {total} held-out titles")
+    print(f"top-1 accuracy: {top1 / total:.1%}")
+    print(f"top-3 accuracy: {top3 / total:.1%}")
+    print(f"mean latency:   {seconds / total * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+import contextvars
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional
+from urllib.parse import urljoin
+
+from cache import CACHE_DIR
+from cassette import current_date
+from extraction import BM25
+
+# Structured index of rausgegangen.de events by city, category and date.
+
+BASE_URL = "https://rausgegangen.de"
+REFRESH_TTL = 15 * 60
+MAX_RESULTS = 15
+# Categories fetched by one find_events_in() call
+MAX_CATEGORIES = 4
+
+# English or umlaut spellings to the city slugs used by rausgegangen.de
+CITY_SLUGS = {
+    "cologne": "koeln",
+    "munich": "muenchen",
+    "nuremberg": "nuernberg",
+    "hanover": "hannover",
+    "frankfurt": "frankfurt-am-main",
+    "dusseldorf": "duesseldorf",
+}
+
+MONTHS = {
+    "jan": 1, "feb": 2, "mär": 3, "mar": 3, "mrz": 3, "apr": 4, "mai": 5, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "okt": 10, "oct": 10, "nov": 11, "dez": 12, "dec": 12,
+}
+
+NUMERIC_DATE = re.compile(r"\b(\d{1,2})\.(\d{1,2})\.(\d{2,4})?")
+WORD_DATE = re.compile(r"\b(\d{1,2})\.?\s+([A-Za-zäÄ]{3})[a-zäü]*\.?(?:\s+(\d{4}))?")
+ISO_DATE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})")
+TIME = re.compile(r"\b([01]?\d|2[0-3]):([0-5]\d)\b")
+TIME_UHR = re.compile(r"\b([01]?\d|2[0-3])(?:[.:]([0-5]\d))?\s*Uhr\b")
+AMOUNT = re.compile(r"\d+(?:[.,]\d{1,2})?\s*€|€\s*\d+(?:[.,]\d{1,2})?")
+FREE = re.compile(r"\b(?:free|gratis|kostenlos|eintritt frei)\b", re.IGNORECASE)
+PRICE = re.compile(f"{AMOUNT.pattern}|{FREE.pattern}", re.IGNORECASE)
+EVENT_LINK = re.compile(r"/events?/")
+# "Heute ab 20 Uhr", "Morgen, 19:00": a relative day at the start of a card's date line
+RELATIVE_DAY = re.compile(r"^(heute|today|tonight|morgen|tomorrow)(?=$|[\s,.:])", re.IGNORECASE)
+CARD_LINES = re.compile(r"\s*[|\n]\s*")
+
+
+@dataclass
+class EventRecord:
+    name: str
+    url: str
+    date: Optional[str] = None
+    time: Optional[str] = None
+    venue: Optional[str] = None
+    price: Optional[str] = None
+    category: Optional[str] = None
+
+
+def city_slug(city: str) -> str:
+    slug = city.strip().lower()
+    for umlaut, plain in (("ä", "ae"), ("ö", "oe"), ("ü", "ue"), ("ß", "ss")):
+        slug = slug.replace(umlaut, plain)
+    slug = re.sub(r"[^a-z0-9]+", "-", slug).strip("-")
+    return CITY_SLUGS.get(slug, slug)
+
+
+def category_url(city: str, category: str) -> str:
+    return f"{BASE_URL}/{city_slug(city)}/kategorie/{category.strip().lower()}"
+
+
+def resolve_date(value: Optional[str], today: Optional[date] = None) -> date:
+    '''
+    "today", "tomorrow" (also German) or an ISO date to a date.
+    '''
+    today = today or current_date()
+    value = (value or "today").strip().lower()
+    if value in ("today", "heute", "tonight", "heute abend"):
+        return today
+    if value in ("tomorrow", "morgen"):
+        return today + timedelta(days=1)
+    return date.fromisoformat(value)
+
+
+def parse_event_date(text: str, today: Optional[date] = None) -> tuple[Optional[str], Optional[str]]:
+    '''
+    Find the date and start time in a card text like "Fr, 18. Jul | 19:00" or "Heute ab 20 Uhr".
+    Returns (YYYY-MM-DD, HH:MM), either may be None.
+    '''
+    today = today or current_date()
+    day = None
+    relative = next((match[1].lower() for line in CARD_LINES.split(text) if (match := _relative_day(line))), None)
+    if relative:
+        day = resolve_date(relative, today)
+    elif match := ISO_DATE.search(text):
+        day = date(int(match[1]), int(match[2]), int(match[3]))
+    elif match := NUMERIC_DATE.search(text):
+        year = int(match[3]) if match[3] else today.year
+        year += 2000 if year < 100 else 0
+        day = _safe_date(year, int(match[2]), int(match[1]))
+    elif (match := WORD_DATE.search(text)) and match[2].lower() in MONTHS:
+        year = int(match[3]) if match[3] else today.year
+        day = _safe_date(year, MONTHS[match[2].lower()], int(match[1]))
+    if day and day < today - timedelta(days=180):
+        # "18. Jan" seen in December belongs to next year
+        day = _safe_date(day.year + 1, day.month, day.day)
+    start = None
+    if match := TIME.search(text) or TIME_UHR.search(text):
+        start = f"{int(match[1]):02d}:{match[2] or '00'}"
+    return (day.isoformat() if day else None), start
+
+
+def _relative_day(line: str) -> Optional[re.Match]:
+    # Only a date line: one with a start time, or just a few words ("Heute", "Morgen ab"),
+    # so titles like "Guten Morgen Yoga" or "Morgens im Park" do not count
+    match = RELATIVE_DAY.match(line.strip())
+    if match and (TIME.search(line) or TIME_UHR.search(line) or len(line.split()) <= 2):
+        return match
+    return None
+
+
+def _safe_date(year: int, month: int, day: int) -> Optional[date]:
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+# Parsing
+
+def _json_ld_events(soup) -> Iterable[dict]:
+    for script in soup.find_all("script", type="application/ld+json"):
+        try:
+            data = json.loads(script.string or "")
+        except json.JSONDecodeError:
+            continue
+        stack = data if isinstance(data, list) else [data]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, list):
+                stack.extend(item)
+            elif isinstance(item, dict):
+                stack.extend(item.get("@graph", []))
+                if "Event" in str(item.get("@type", "")):
+                    yield item
+
+
+def _from_json_ld(item: dict, page_url: str) -> Optional[EventRecord]:
+    name, url = item.get("name"), item.get("url")
+    if not name or not url:
+        return None
+    day, start = None, None
+    if item.get("startDate"):
+        try:
+            begin = datetime.fromisoformat(item["startDate"].replace("Z", "+00:00"))
+            day = begin.date().isoformat()
+            start = begin.strftime("%H:%M") if "T" in item["startDate"] else None
+        except ValueError:
+            pass
+    location = item.get("location") or {}
+    if isinstance(location, list):
+        location = location[0] if location else {}
+    venue = location.get("name") if isinstance(location, dict) else str(location)
+    offers = item.get("offers") or {}
+    if isinstance(offers, list):
+        offers = offers[0] if offers else {}
+    price = None
+    if isinstance(offers, dict) and offers.get("price") not in (None, ""):
+        price = f"{offers['price']} {offers.get('priceCurrency', '€')}".replace("EUR", "€")
+    return EventRecord(name=name.strip(), url=urljoin(page_url, url), date=day, time=start, venue=venue, price=price)
+
+
+def _from_card(link, page_url: str, today: date) -> Optional[EventRecord]:
+    lines = [line.strip() for line in link.get_text("\n").split("\n") if line.strip()]
+    if not lines:
+        return None
+    heading = link.find(["h1", "h2", "h3", "h4", "h5", "h6"])
+    day, start = parse_event_date(" | ".join(lines), today)
+    rest = [line for line in lines
+            if not TIME.search(line) and not TIME_UHR.search(line) and not PRICE.fullmatch(line)
+            and parse_event_date(line, today)[0] is None]
+    name = heading.get_text(" ", strip=True) if heading else (max(rest, key=len) if rest else lines[0])
+    venue = next((line for line in rest if line != name), None)
+    # The price is read from the lines after the name ("Freestyle Battle" is not free), an amount before a free word
+    last_name_line = max((i for i, line in enumerate(lines) if line in name), default=-1)
+    details = " ".join(lines[last_name_line + 1:])
+    price_match = AMOUNT.search(details) or FREE.search(details)
+    return EventRecord(name=name, url=urljoin(page_url, link["href"]).split("?")[0], date=day, time=start,
+                       venue=venue, price=price_match[0] if price_match else None)
+
+
+def parse_category_page(html: str, page_url: str, today: Optional[date] = None) -> list[EventRecord]:
+    '''
+    Event records from a rendered rausgegangen.de category page. Uses the
+    schema.org JSON-LD data if the page has it, otherwise the event cards.
+    '''
+    from bs4 import BeautifulSoup
+
+    today = today or current_date()
+    soup = BeautifulSoup(html, "lxml")
+    events = {}
+    for item in _json_ld_events(soup):
+        record = _from_json_ld(item, page_url)
+        if record:
+            events[record.url] = record
+    if not events:
+        for link in soup.find_all("a", href=EVENT_LINK):
+            record = _from_card(link, page_url, today)
+            if record and record.url not in events:
+                events[record.url] = record
+    return list(events.values())
+
+
+# Index
+
+class EventIndex:
+    '''
+    SQLite table of events keyed by (city, category, url) with an index on
+    (city, category, date). Category pages are re-scraped at most every
+    `refresh_ttl` seconds and merged into the table.
+    '''
+
+    def __init__(self, path: Optional[str] = None, refresh_ttl: float = REFRESH_TTL):
+        self.path = path or os.path.join(CACHE_DIR, "events.sqlite")
+        self.refresh_ttl = refresh_ttl
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS events (
+                city TEXT NOT NULL,
+                category TEXT NOT NULL,
+                url TEXT NOT NULL,
+                name TEXT NOT NULL,
+                date TEXT,
+                time TEXT,
+                venue TEXT,
+                price TEXT,
+                last_seen REAL NOT NULL,
+                PRIMARY KEY (city, category, url)
+            );
+            CREATE INDEX IF NOT EXISTS events_by_day ON events (city, category, date);
+            CREATE TABLE IF NOT EXISTS refreshes (
+                city TEXT NOT NULL,
+                category TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (city, category)
+            );
+            """
+        )
+        self._db.commit()
+
+    def is_stale(self, city: str, category: str) -> bool:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT fetched_at FROM refreshes WHERE city = ? AND category = ?", (city, category)
+            ).fetchone()
+        return row is None or time.time() - row[0] > self.refresh_ttl
+
+    def update(self, city: str, category: str, records: list[EventRecord]):
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                """INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (city, category, url) DO UPDATE SET
+                   name = excluded.name, date = excluded.date, time = excluded.time,
+                   venue = excluded.venue, price = excluded.price, last_seen = excluded.last_seen""",
+                [(city, category, r.url, r.name, r.date, r.time, r.venue, r.price, now) for r in records],
+            )
+            # Events that are over are not needed any more
+            self._db.execute("DELETE FROM events WHERE date < ?", ((current_date() - timedelta(days=1)).isoformat(),))
+            self._db.execute("INSERT OR REPLACE INTO refreshes VALUES (?, ?, ?)", (city, category, now))
+            self._db.commit()
+
+    def query(self, city: str, category: str, day: Optional[date] = None) -> list[EventRecord]:
+        sql = "SELECT name, url, date, time, venue, price, category FROM events WHERE city = ? AND category = ?"
+        args = [city, category]
+        if day is not None:
+            sql += " AND date = ?"
+            args.append(day.isoformat())
+        sql += " ORDER BY date, time, name"
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+        return [EventRecord(*row) for row in rows]
+
+
+def fetch_category_page(url: str) -> list[EventRecord]:
+    from fetch import fetch_page
+
+    page = fetch_page(url)
+    records = parse_category_page(page.html, page.url)
+    if not records and page.tier == "http":
+        # The event cards may only be rendered by JavaScript
+        page = fetch_page(url, use_http=False)
+        records = parse_category_page(page.html, page.url)
+    return records
+
+
+_index: Optional[EventIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_event_index() -> EventIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = EventIndex()
+        return _index
+
+
+def find_events(city: str, category: str, day: Optional[date] = None) -> list[EventRecord]:
+    '''
+    Events of one category in a city (on `day`), scraping the category page
+    first if the index has no recent copy of it.
+    '''
+    index = get_event_index()
+    city, category = city_slug(city), category.strip().lower()
+    if index.is_stale(city, category):
+        url = category_url(city, category)
+        index.update(city, category, fetch_category_page(url))
+    return index.query(city, category, day)
+
+
+_category_fetchers = ThreadPoolExecutor(max_workers=2 * MAX_CATEGORIES, thread_name_prefix="categories")
+
+
+def find_events_in(city: str, categories: Iterable[str], day: Optional[date] = None) -> tuple[list[EventRecord], dict[str, str]]:
+    '''
+    Events of several categories, fetched concurrently and merged. An event listed
+    in more than one category is kept once, under the first of them.
+    Also returns the error of every category that could not be fetched.
+    '''
+    categories = list(dict.fromkeys(c.strip().lower() for c in categories if c.strip()))[:MAX_CATEGORIES]
+    futures = {category: _category_fetchers.submit(contextvars.copy_context().run, find_events, city, category, day)
+               for category in categories}
+    events, seen, errors = [], set(), {}
+    for category, future in futures.items():
+        try:
+            found = future.result()
+        except Exception as e:
+            errors[category] = str(e) or type(e).__name__
+            continue
+        for event in found:
+            if event.url not in seen:
+                seen.add(event.url)
+                events.append(event)
+    events.sort(key=lambda e: (e.date or "", e.time or ""))
+    return events, errors
+
+
+def rank_events(events: list[EventRecord], query: Optional[str]) -> list[EventRecord]:
+    '''
+    Best BM25 matches of `query` against name, venue and category first,
+    events that match equally well stay in order of their start.
+    '''
+    if not query or not events:
+        return events
+    scores = BM25([" ".join(filter(None, [e.name, e.venue, e.category])) for e in events]).scores(query)
+    order = sorted(range(len(events)), key=lambda i: scores[i], reverse=True)
+    return [events[i] for i in order]
+
+
+def format_event(number: int, event: EventRecord, with_category: bool = False) -> str:
+    fields = [event.name, " ".join(filter(None, [event.date, event.time])), event.venue, event.price, event.url]
+    if with_category:
+        fields.insert(4, event.category)
+    return f"{number}. " + " | ".join(field or "?" for field in fields)
@@ -0,0 +1,216 @@
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+
+from tokens import count_tokens, truncate_tokens
+
+# Turns a rendered page into a few query relevant passages instead of the whole body text.
+
+# Runs in the page: drops navigation, cookie banners, footers etc. and returns the
+# text of the main content element (or the cleaned body if there is none).
+MAIN_TEXT_JS = """
+() => {
+  const junk = [
+    'script', 'style', 'noscript', 'template', 'svg', 'iframe', 'nav', 'header', 'footer', 'aside', 'form',
+    '[role=navigation]', '[role=banner]', '[role=contentinfo]', '[role=dialog]', '[aria-modal=true]',
+    '[id*=cookie i]', '[class*=cookie i]', '[id*=consent i]', '[class*=consent i]',
+    '[class*=newsletter i]', '[class*=popup i]', '[class*=modal i]'
+  ];
+  document.querySelectorAll(junk.join(',')).forEach(el => el.remove());
+  const main = document.querySelector('main, [role=main], article');
+  if (main && main.innerText.trim().length > 200) return main.innerText;
+  return document.body ? document.body.innerText : '';
+}
+"""
+
+# The same for HTML parsed without a browser
+JUNK_TAGS = ["script", "style", "noscript", "template", "svg", "iframe", "nav", "header", "footer", "aside", "form"]
+JUNK_ROLES = {"navigation", "banner", "contentinfo", "dialog"}
+JUNK_ATTRIBUTE = re.compile(r"cookie|consent|newsletter|popup|modal", re.IGNORECASE)
+# Elements that start a new line in the rendered text
+BLOCK_TAGS = ["p", "div", "section", "article", "main", "li", "ul", "ol", "tr", "table", "dt", "dd",
+              "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "figcaption", "address"]
+
+# Short lines matching this are leftovers of cookie banners, menus and footers
+BOILERPLATE_LINE = re.compile(
+    r"cookie|datenschutz|privacy|impressum|imprint|newsletter|alle akzeptieren|accept all|"
+    r"skip to|zum inhalt|folge uns|follow us|©|copyright|\bagb\b|terms of (use|service)",
+    re.IGNORECASE,
+)
+BOILERPLATE_MAX_LEN = 80
+
+CHUNK_TOKENS = 150
+MAX_TOKENS = 1500
+TOP_K = 8
+
+WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def _is_junk(tag) -> bool:
+    if tag.name in ("html", "body"):
+        return False
+    attributes = " ".join([tag.get("id") or ""] + (tag.get("class") or []))
+    return (tag.get("role") in JUNK_ROLES or tag.get("aria-modal") == "true"
+            or bool(JUNK_ATTRIBUTE.search(attributes)))
+
+
+def html_to_text(html: str) -> str:
+    '''
+    Main text of an HTML document, like MAIN_TEXT_JS but on the parsed HTML.
+    '''
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "lxml")
+    for element in soup(JUNK_TAGS) + soup.find_all(_is_junk):
+        element.decompose()
+    for br in soup("br"):
+        br.replace_with("\n")
+    for element in soup(BLOCK_TAGS):
+        element.insert_before("\n")
+        element.insert_after("\n")
+    main = soup.select_one("main, [role=main], article")
+    if main is not None and len(main.get_text().strip()) > 200:
+        return main.get_text()
+    return soup.body.get_text() if soup.body else soup.get_text()
+
+
+def clean_text(text: str) -> str:
+    '''
+    Normalize whitespace and drop empty, repeated and boilerplate lines.
+    '''
+    lines, seen = [], set()
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        if not line:
+            continue
+        key = line.lower()
+        if key in seen:
+            continue
+        if len(line) <= BOILERPLATE_MAX_LEN and BOILERPLATE_LINE.search(line):
+            continue
+        seen.add(key)
+        lines.append(line)
+    return "\n".join(lines)
+
+
+@dataclass
+class Chunk:
+    start: int
+    end: int
+    text: str
+    tokens: int
+
+
+def _segments(text: str, max_chars: int):
+    """
+    (start, end) offsets of the lines of `text`; overlong lines are split at
+    sentence ends or spaces so that no segment exceeds `max_chars`.
+    """
+    pos = 0
+    for line in text.split("\n"):
+        line_start, line_end = pos, pos + len(line)
+        while line_end - line_start > max_chars:
+            window = text[line_start:line_start + max_chars]
+            cut = max(window.rfind(". "), window.rfind("! "), window.rfind("? "))
+            if cut < max_chars // 2:
+                cut = window.rfind(" ")
+            if cut <= 0:
+                cut = max_chars - 1
+            yield line_start, line_start + cut + 1
+            line_start += cut + 1
+        yield line_start, line_end
+        pos = line_end + 1
+
+
+def chunk_text(text: str, chunk_tokens: int = CHUNK_TOKENS) -> list[Chunk]:
+    '''
+    Split `text` into chunks of whole lines of roughly `chunk_tokens` tokens.
+    start/end are character offsets into `text`.
+    '''
+    chunks = []
+    start, size = None, 0
+    for seg_start, seg_end in _segments(text, chunk_tokens * 4):
+        if start is None:
+            start = seg_start
+        size += count_tokens(text[seg_start:seg_end])
+        if size >= chunk_tokens:
+            chunks.append(Chunk(start, seg_end, text[start:seg_end].strip(), size))
+            start, size = None, 0
+    if start is not None and start < len(text):
+        chunks.append(Chunk(start, len(text), text[start:].strip(), size))
+    return chunks
+
+
+def tokenize(text: str) -> list[str]:
+    return WORD.findall(text.lower())
+
+
+class BM25:
+    '''
+    Okapi BM25 over a small in-memory list of documents.
+    '''
+
+    def __init__(self, documents: list[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = [Counter(tokenize(doc)) for doc in documents]
+        self.lengths = [sum(doc.values()) for doc in self.docs]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.docs else 0
+        df = Counter(term for doc in self.docs for term in doc)
+        n = len(self.docs)
+        self.idf = {term: math.log(1 + (n - freq + 0.5) / (freq + 0.5)) for term, freq in df.items()}
+
+    def scores(self, query: str) -> list[float]:
+        terms = tokenize(query)
+        result = []
+        for doc, length in zip(self.docs, self.lengths):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * length / (self.avg_length or 1))
+            for term in terms:
+                freq = doc.get(term)
+                if freq:
+                    score += self.idf[term] * freq * (self.k1 + 1) / (freq + norm)
+            result.append(score)
+        return result
+
+
+def select_chunks(text: str, query: Optional[str] = None, max_tokens: int = MAX_TOKENS, top_k: int = TOP_K) -> list[Chunk]:
+    '''
+    Pick at most `top_k` chunks within `max_tokens`: the best BM25 matches for `query`,
+    or the leading chunks if there is no query or nothing matches. Returned in page order.
+    '''
+    chunks = chunk_text(text)
+    order = list(range(len(chunks)))
+    ranked = False
+    if query and chunks:
+        scores = BM25([c.text for c in chunks]).scores(query)
+        if any(scores):
+            order = sorted((i for i in order if scores[i] > 0), key=lambda i: scores[i], reverse=True)
+            ranked = True
+    picked, used = [], 0
+    for i in order:
+        if len(picked) >= top_k:
+            break
+        chunk = chunks[i]
+        if used + chunk.tokens > max_tokens:
+            if picked:
+                # Matches may skip a chunk that does not fit, the beginning of the page has to stay in one piece
+                if ranked:
+                    continue
+                break
+            # The first chunk is always returned, cut to the budget
+            cut = truncate_tokens(chunk.text, max_tokens)
+            chunk = Chunk(chunk.start, chunk.start + len(cut), cut, count_tokens(cut))
+        picked.append(chunk)
+        used += chunk.tokens
+    return sorted(picked, key=lambda c: c.start)
+
+
+def format_chunks(url: str, text: str, chunks: list[Chunk]) -> str:
+    total = count_tokens(text)
+    used = sum(c.tokens for c in chunks)
+    header = f"{url} - {len(chunks)} passages, {used} of {total} tokens"
+    passages = [f"[chars {c.start}-{c.end}]\n{c.text}" for c in chunks]
+    return "\n\n".join([header] + passages)
@@ -0,0 +1,170 @@
+import contextvars
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+# Facts about the user in SQLite, one namespace per user. Writes are single
+# transactions, duplicates are rejected through indexed normalized forms and
+# only the facts relevant to the current message are put into the prompt.
+
+FACTS_DB = os.getenv("FACTS_DB", "facts.sqlite")
+LEGACY_FACTS_FILE = "facts.json"
+DEFAULT_USER = "default"
+TOP_K = 5
+
+# Words that do not change what a fact says about the user
+STOPWORDS = {
+    "the", "a", "an", "is", "are", "am", "was", "to", "of", "and", "user", "users", "user's", "he", "she", "they",
+    "his", "her", "their", "likes", "like", "der", "die", "das", "ist", "ein", "eine", "und", "nutzer", "benutzer",
+}
+
+WORD = re.compile(r"\w+", re.UNICODE)
+
+# User whose facts the tools of the current agent run read and write
+current_user: contextvars.ContextVar[str] = contextvars.ContextVar("current_user", default=DEFAULT_USER)
+
+
+def normalize_fact(fact: str) -> str:
+    return " ".join(WORD.findall(fact.lower()))
+
+
+def fact_signature(fact: str) -> str:
+    '''
+    Order independent set of content words, equal for near-duplicate phrasings
+    like "The user lives in Berlin." and "lives in berlin".
+    '''
+    words = {w for w in WORD.findall(fact.lower()) if w not in STOPWORDS}
+    return " ".join(sorted(words))
+
+
+class FactStore:
+    def __init__(self, path: str = FACTS_DB):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS facts (
+                id INTEGER PRIMARY KEY,
+                user TEXT NOT NULL,
+                fact TEXT NOT NULL,
+                norm TEXT NOT NULL,
+                signature TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                UNIQUE (user, norm)
+            );
+            CREATE INDEX IF NOT EXISTS facts_by_signature ON facts (user, signature);
+            """
+        )
+        try:
+            self._db.executescript(
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS facts_fts USING fts5(fact, content='facts', content_rowid='id');
+                CREATE TRIGGER IF NOT EXISTS facts_fts_insert AFTER INSERT ON facts BEGIN
+                    INSERT INTO facts_fts (rowid, fact) VALUES (new.id, new.fact);
+                END;
+                CREATE TRIGGER IF NOT EXISTS facts_fts_delete AFTER DELETE ON facts BEGIN
+                    INSERT INTO facts_fts (facts_fts, rowid, fact) VALUES ('delete', old.id, old.fact);
+                END;
+                """
+            )
+            self.full_text = True
+        except sqlite3.OperationalError:
+            # SQLite without FTS5, relevant() falls back to ranking in Python
+            self.full_text = False
+        self._db.commit()
+        self._import_legacy_file()
+
+    def _import_legacy_file(self):
+        if not os.path.exists(LEGACY_FACTS_FILE) or self.facts(DEFAULT_USER, limit=1):
+            return
+        with open(LEGACY_FACTS_FILE, "r") as f:
+            for fact in json.load(f):
+                self.add(fact, DEFAULT_USER)
+
+    def add(self, fact: str, user: str = DEFAULT_USER) -> bool:
+        '''
+        Store `fact` for `user`. Returns False if it (or a near-duplicate) is already stored.
+        '''
+        fact = " ".join(fact.split())
+        norm, signature = normalize_fact(fact), fact_signature(fact)
+        with self._lock:
+            # A fact of stopwords only ("The user") has an empty signature, which says nothing about
+            # near-duplicates; only its exact repeats are rejected, by the unique norm
+            duplicate = signature and self._db.execute(
+                "SELECT 1 FROM facts WHERE user = ? AND signature = ? LIMIT 1", (user, signature)
+            ).fetchone()
+            if duplicate:
+                return False
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO facts (user, fact, norm, signature, created_at) VALUES (?, ?, ?, ?, ?)",
+                (user, fact, norm, signature, time.time()),
+            )
+            self._db.commit()
+            return cursor.rowcount == 1
+
+    def facts(self, user: str = DEFAULT_USER, limit: Optional[int] = None) -> list[str]:
+        '''
+        Facts of `user`, newest first.
+        '''
+        sql = "SELECT fact FROM facts WHERE user = ? ORDER BY created_at DESC"
+        args: list = [user]
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(limit)
+        with self._lock:
+            return [row[0] for row in self._db.execute(sql, args)]
+
+    def relevant(self, message: str, user: str = DEFAULT_USER, k: int = TOP_K) -> list[str]:
+        '''
+        The `k` facts of `user` that match `message` best, topped up with the newest facts.
+        '''
+        words = {w for w in WORD.findall(message.lower()) if w not in STOPWORDS}
+        matches = []
+        if words and self.full_text:
+            query = " OR ".join(f'"{w}"' for w in words)
+            with self._lock:
+                matches = [row[0] for row in self._db.execute(
+                    """SELECT facts.fact FROM facts_fts JOIN facts ON facts.id = facts_fts.rowid
+                       WHERE facts_fts MATCH ? AND facts.user = ? ORDER BY bm25(facts_fts) LIMIT ?""",
+                    (query, user, k),
+                )]
+        elif words:
+            from extraction import BM25
+
+            candidates = self.facts(user)
+            scores = BM25(candidates).scores(" ".join(words)) if candidates else []
+            ranked = sorted(zip(scores, candidates), key=lambda pair: pair[0], reverse=True)
+            matches = [fact for score, fact in ranked[:k] if score > 0]
+        for fact in self.facts(user, limit=k):
+            if len(matches) >= k:
+                break
+            if fact not in matches:
+                matches.append(fact)
+        return matches
+
+
+_store: Optional[FactStore] = None
+_store_lock = threading.Lock()
+
+
+def get_fact_store() -> FactStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = FactStore()
+        return _store
+
+
+def facts_prompt(message: str, user: Optional[str] = None, k: int = TOP_K) -> str:
+    '''
+    Bullet list of the facts relevant to `message`, for the system prompt of the current turn.
+    '''
+    facts = get_fact_store().relevant(message, user or current_user.get(), k)
+    if not facts:
+        return "No facts about the user are known yet."
+    return "\n".join(f"- {fact}" for fact in facts)
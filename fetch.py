@@ -0,0 +1,226 @@
+import difflib
+import functools
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cassette import recorded
+from deadlines import CircuitOpen, get_breaker, retrying, time_left
+from extraction import MAIN_TEXT_JS, html_to_text
+from metrics import register_source, span
+
+# Tiered page fetching: a plain HTTP GET with the HTML parsed in Python first,
+# the browser pool only for pages that need JavaScript to show their content.
+
+HTTP_TIMEOUT = 10
+BROWSER_TIMEOUT = 25
+# Answers worth asking again after a short pause
+RETRY_STATUS = {429, 502, 503, 504}
+RETRY_ERRORS = (requests.ConnectionError, requests.Timeout, requests.HTTPError)
+# Less main text than this and the page is probably rendered by JavaScript
+MIN_TEXT_CHARS = 200
+USER_AGENT = (
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/126.0 Safari/537.36"
+)
+# Empty app containers and "please enable JavaScript" notices of client side rendered pages
+JS_SHELL = re.compile(
+    r"<div id=\"(?:root|app|__nuxt)\"[^>]*>\s*</div>|enable javascript|javascript is (?:required|disabled)",
+    re.IGNORECASE,
+)
+META_CHARSET = re.compile(rb"<meta[^>]+charset=[\"']?([\w-]+)", re.IGNORECASE)
+LINK_CUTOFF = 0.6
+
+_session = requests.Session()
+_session.headers.update({"User-Agent": USER_AGENT, "Accept-Language": "de,en;q=0.8"})
+_session.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32))
+_session.mount("http://", HTTPAdapter(pool_connections=32, pool_maxsize=32))
+
+
+@dataclass
+class Page:
+    url: str
+    html: str
+    text: str
+    tier: str
+    headers: dict = field(default_factory=dict)
+
+
+# Per tier: requests, how many of them produced the page, errors and recent latencies
+_lock = threading.Lock()
+_stats = {
+    tier: {"requests": 0, "used": 0, "errors": 0, "latencies": deque(maxlen=1000)}
+    for tier in ("http", "browser")
+}
+
+
+def _record(tier: str, started: float, outcome: str):
+    with _lock:
+        stats = _stats[tier]
+        stats["requests"] += 1
+        if outcome in ("used", "errors"):
+            stats[outcome] += 1
+        stats["latencies"].append(time.perf_counter() - started)
+
+
+def needs_browser(html: str, text: str) -> bool:
+    return len(text.strip()) < MIN_TEXT_CHARS or (len(text) < 5 * MIN_TEXT_CHARS and bool(JS_SHELL.search(html)))
+
+
+def _decode(response: requests.Response) -> str:
+    # requests assumes ISO-8859-1 for text/html without a charset header
+    if "charset" not in response.headers.get("content-type", "").lower():
+        match = META_CHARSET.search(response.content[:4096])
+        response.encoding = match.group(1).decode("ascii") if match else "utf-8"
+    return response.text
+
+
+def fetch_http(url: str, timeout: Optional[float] = None) -> Optional[Page]:
+    '''
+    The page from a plain GET, or None if it failed or needs a browser.
+    '''
+    def get():
+        response = _session.get(url, timeout=time_left(min(timeout or HTTP_TIMEOUT, HTTP_TIMEOUT)))
+        if response.status_code in RETRY_STATUS:
+            response.raise_for_status()
+        return response
+
+    started = time.perf_counter()
+    try:
+        response = retrying(get, url, retry_on=RETRY_ERRORS)
+    except CircuitOpen:
+        _record("http", started, "errors")
+        raise
+    except requests.RequestException:
+        _record("http", started, "errors")
+        return None
+    content_type = response.headers.get("content-type", "")
+    if response.status_code >= 400 or not content_type.startswith(("text/", "application/xhtml")):
+        _record("http", started, "fallback")
+        return None
+    html = _decode(response)
+    text = html_to_text(html) if "html" in content_type else html
+    if needs_browser(html, text):
+        _record("http", started, "fallback")
+        return None
+    _record("http", started, "used")
+    return Page(response.url, html, text, "http", dict(response.headers))
+
+
+def fetch_browser(url: str, timeout: Optional[float] = None) -> Page:
+    from browser import get_browser_pool
+
+    seconds = time_left(min(timeout or BROWSER_TIMEOUT, BROWSER_TIMEOUT))
+    breaker = get_breaker(url)
+    if not breaker.allow():
+        raise CircuitOpen(f"{urlsplit(url).hostname} failed repeatedly, not trying again for now")
+
+    async def render(page):
+        # Playwright waits up to 30 s per step by default
+        page.set_default_timeout(seconds * 1000)
+        response = await page.goto(url)
+        headers = await response.all_headers() if response else {}
+        html = await page.content()
+        return page.url, html, await page.evaluate(MAIN_TEXT_JS), headers
+
+    started = time.perf_counter()
+    try:
+        final_url, html, text, headers = get_browser_pool().run(render, seconds)
+    except Exception:
+        breaker.failure()
+        _record("browser", started, "errors")
+        raise
+    breaker.success()
+    _record("browser", started, "used")
+    return Page(final_url, html, text, "browser", headers)
+
+
+def fetch_page(url: str, timeout: Optional[float] = None, use_http: bool = True) -> Page:
+    '''
+    Fetch `url` with plain HTTP if that gives the page's content, with the browser otherwise.
+    '''
+    key = f"{'http' if use_http else 'browser'} {url}"
+    return recorded("page", key, functools.partial(_fetch_page, url, timeout, use_http), encode=asdict,
+                    decode=lambda value: Page(**value))
+
+
+def _fetch_page(url: str, timeout: Optional[float], use_http: bool) -> Page:
+    host = urlsplit(url).hostname
+    if use_http:
+        with span("http", "fetch", host=host) as s:
+            page = fetch_http(url, timeout)
+            s.attrs["outcome"] = "used" if page is not None else "fallback"
+        if page is not None:
+            return page
+    with span("browser", "fetch", host=host):
+        return fetch_browser(url, timeout)
+
+
+def _link_score(name: str, text: str) -> float:
+    if not text:
+        return 0.0
+    if name in text:
+        # Card links often carry date and venue next to the name
+        return 1.0 if name == text else 0.95
+    return difflib.SequenceMatcher(None, name, text).ratio()
+
+
+def find_link(html: str, base_url: str, name: str, cutoff: float = LINK_CUTOFF) -> Optional[str]:
+    '''
+    Absolute URL of the link whose text (or title / aria-label) matches `name` best.
+    '''
+    from bs4 import BeautifulSoup
+
+    name = " ".join(name.lower().split())
+    best, best_score = None, cutoff
+    for anchor in BeautifulSoup(html, "lxml").find_all("a", href=True):
+        if anchor["href"].startswith(("#", "javascript:", "mailto:")):
+            continue
+        labels = [anchor.get_text(" "), anchor.get("title") or "", anchor.get("aria-label") or ""]
+        score = max(_link_score(name, " ".join(label.lower().split())) for label in labels)
+        if score > best_score:
+            best, best_score = urljoin(base_url, anchor["href"]), score
+    return best
+
+
+def fetch_stats() -> dict:
+    '''
+    Requests, hit rate and latency percentiles (ms) per tier.
+    '''
+    def percentile(latencies: list[float], q: float) -> Optional[float]:
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000, 1)
+
+    report = {}
+    with _lock:
+        for tier, stats in _stats.items():
+            latencies = sorted(stats["latencies"])
+            report[tier] = {
+                "requests": stats["requests"],
+                "used": stats["used"],
+                "errors": stats["errors"],
+                "hit_rate": stats["used"] / stats["requests"] if stats["requests"] else None,
+                "p50_ms": percentile(latencies, 0.5),
+                "p95_ms": percentile(latencies, 0.95),
+            }
+    return report
+
+
+def fetch_report() -> str:
+    lines = []
+    for tier, s in fetch_stats().items():
+        if s["requests"]:
+            lines.append(f"{tier}: {s['requests']} requests, {s['used']} used ({s['hit_rate']:.0%}), "
+                         f"{s['errors']} errors, p50 {s['p50_ms']} ms, p95 {s['p95_ms']} ms")
+    return "\n".join(lines)
+
+
+register_source("fetch", fetch_stats)
@@ -1,49 +1,28 @@
-from llama_index.core.memory import ChatMemoryBuffer
-from llama_index.core.agent.workflow import ReActAgent, AgentWorkflow, AgentStream, ToolCallResult
-from llama_index.core import PromptTemplate
-from llama_index.core.workflow import Context
-from llama_index.llms.openai import OpenAI
-from tools import search_tool, duckduckgo_tool, weather_tool, date_tool, summarize_webpage_tool, browse_rausgegangen_de_categories_tool, classify_query_tool, load_facts, store_fact_tool, create_ics_tool, more_information_tool
+from tools import AGENT_TOOLS, get_tools
+from browser import shutdown_browser_pool
+from fetch import fetch_report
+from metrics import current_trace, start_trace
+from observations import savings_report
+from protocol import StepTracer, TraceWriter
 from dotenv import load_dotenv
-import gradio as gr
 import os
-from datetime import datetime
-import json
-import os
-today = datetime.now().strftime("%Y-%m-%d")
-
-def append_string_to_protocol(string: str):
-  with open('gaia_protocol.txt', 'a') as f:
-    f.write(string)
-    
-def append_message_to_protocol(file_path: str, new_input: str, new_output: str):
-  # Step 1: Load existing messages or initialize empty list
-  if os.path.exists(file_path):
-    with open(file_path, 'r', encoding='utf-8') as f:
-      try:
-        messages = json.load(f)
-      except json.JSONDecodeError:
-        messages = []
-  else:
-    messages = []
-
-  # Step 2: Append new message
-  new_message = {"input": new_input, "output": new_output}
-  messages.append(new_message)
-
-  # Step 3: Save updated list back to file
-  with open(file_path, 'w', encoding='utf-8') as f:
-    json.dump(messages, f, indent=2, ensure_ascii=False)
+import threading
 
-load_dotenv()
+# Like app.py, gradio and llama_index are only imported by the factories below,
+# so gaia_batch workers and the benchmarks start fast.
 
-llm = OpenAI(model="gpt-4o")
+load_dotenv()
 
-# Import tools
-tools = [duckduckgo_tool(), summarize_webpage_tool(), weather_tool(), date_tool(), browse_rausgegangen_de_categories_tool(), classify_query_tool(), store_fact_tool(), create_ics_tool(), more_information_tool()]
+_llm = None
+_llm_lock = threading.Lock()
 
-#Init Memory
-memory = ChatMemoryBuffer.from_defaults(token_limit=40000)
+def get_llm():
+  global _llm
+  with _llm_lock:
+    if _llm is None:
+      from llama_index.llms.openai import OpenAI
+      _llm = OpenAI(model="gpt-4o")
+    return _llm
 
 # System_prompt
 gaia_system_prompt = "You are a general AI assistant. I will ask you a question. Report your thoughts, and finish your answer with the following template: Answer: [YOUR FINAL ANSWER]. YOUR FINAL ANSWER should be a number OR as few words as possible OR a comma separated list of numbers and/or strings. If you are asked for a number, don't use comma to write your number neither use units such as $ or percent sign unless specified otherwise. If you are asked for a string, don't use articles, neither abbreviations (e.g. for cities), and write the digits in plain text unless specified otherwise. If you are asked for a comma separated list, apply the above rules depending of whether the element to be put in the list is a number or a string."
@@ -100,77 +79,133 @@ Below is the current conversation consisting of interleaving human and assistant
 
 
 # Define Agent
-agent = ReActAgent(
-    tools=tools,
-    llm=llm
-)
-
-react_system_prompt = PromptTemplate(gaia_system_prompt + react_header_prompt)
-
-agent.update_prompts({'react_header': react_system_prompt})
-
-ctx = Context(agent)
-
-async def run_agent(message):
-  handler = agent.run(message, return_stream=True, ctx=ctx, memory=memory)
-  toughts, tool_calls, final, protocol = "", "", "", ""
-
-  async for ev in handler.stream_events():
-    if isinstance(ev, ToolCallResult):
-      tool_calls += f"🔧 {ev.tool_name}({ev.tool_kwargs}) => {ev.tool_output}\n\n"
-      protocol += f"🔧 {ev.tool_name}({ev.tool_kwargs}) => {ev.tool_output}\n\n"
-    elif isinstance(ev, AgentStream):
-      toughts += ev.delta
-      protocol += ev.delta
-
-  final_result = await handler
-  final += str(final_result)
-  return toughts.strip(), tool_calls.strip(), final.strip(), protocol.strip()
-
-
-with gr.Blocks(fill_height=True) as gradio_ui:
-  gr.Markdown("# Gaia Benchmark Agent")
-  with gr.Row():
-    chatbot = gr.Chatbot(type="messages", show_copy_button=True)
-    with gr.Column(visible=False) as right_column:
-      thoughts_box = gr.Textbox(label="🧠 Agent Thoughts", lines=8)
-      tools_box = gr.Textbox(label="🔧 Tool Calls", lines=8)
-      file_download = gr.File(label="📅 ICS-file", visible=False)
-
-  msg = gr.Textbox(label="Your message")
-  send_btn = gr.Button("Send")
-  toggle_btn = gr.Button("Toggle Debug View")
-
-
-  async def respond(user_input, chat_history):
-    thoughts, tools, final, protocol = await run_agent(user_input)
-    chat_history.append({"role": "user", "content": user_input})
-    chat_history.append({"role": "assistant", "content": final})
-    download_path = None
-    file_output = gr.update(value=None, visible=False)
-    if ".ics" in tools:
-      for line in tools.splitlines():
-        if ".ics" in line:
-          potential = line.split("=>")[-1].strip()
-          if os.path.exists(potential):
-            file_output = gr.update(value=potential, visible=True)
-            break
-    
-    append_message_to_protocol("gaia_protocol.json", user_input, protocol)
-
-    return chat_history, thoughts, tools, "", file_output
-
-
-  send_btn.click(fn=respond, inputs=[msg, chatbot], outputs=[chatbot, thoughts_box, tools_box, msg, file_download])
-  msg.submit(fn=respond, inputs=[msg, chatbot], outputs=[chatbot, thoughts_box, tools_box, msg, file_download])
-
-  # Keep track of visibility state
-  show_debug = gr.State(value=True)
-
-  def toggle_debug_view(show):
-    return gr.update(visible=not show), not show
-
-  toggle_btn.click(fn=toggle_debug_view, inputs=[show_debug], outputs=[right_column, show_debug])
+_prompt_builder = None
+_prompt_builder_lock = threading.Lock()
+
+def get_prompt_builder():
+  global _prompt_builder
+  with _prompt_builder_lock:
+    if _prompt_builder is None:
+      from prompts import PromptBuilder
+      _prompt_builder = PromptBuilder([("gaia", gaia_system_prompt), ("instructions", react_header_prompt)])
+    return _prompt_builder
+
+def build_agent(llm=None):
+  from llama_index.core.agent.workflow import ReActAgent
+
+  agent = ReActAgent(
+      tools=get_tools(AGENT_TOOLS),
+      llm=llm or get_llm(),
+      formatter=get_prompt_builder().formatter("gaia")
+  )
+  return agent
+
+# Agent, context and memory of the UI, built on first use
+_default = None
+
+def default_session():
+  global _default
+  if _default is None:
+    from llama_index.core.workflow import Context
+    from compact_memory import CompactMemory
+    agent = build_agent()
+    _default = (agent, Context(agent), CompactMemory.from_defaults())
+  return _default
+
+trace_writer = TraceWriter("gaia_trace.jsonl")
+
+async def run_agent(message, agent=None, ctx=None, memory=None, on_event=None):
+  from llama_index.core.agent.workflow import AgentStream, ToolCallResult
+
+  if agent is None:
+    agent, ctx, memory = default_session()
+  tracer = StepTracer(trace_writer, message)
+  # Seconds spent in LLM calls, tools and fetches go into the answer record
+  trace, traced = start_trace()
+  try:
+    handler = agent.run(message, return_stream=True, ctx=ctx, memory=memory)
+  finally:
+    current_trace.reset(traced)
+  toughts, tool_calls, final = "", "", ""
+
+  try:
+    async for ev in handler.stream_events():
+      tracer.on_event(ev)
+      trace.on_event(ev)
+      if on_event:
+        on_event(ev)
+      if isinstance(ev, ToolCallResult):
+        tool_calls += f"🔧 {ev.tool_name}({ev.tool_kwargs}) => {ev.tool_output}\n\n"
+      elif isinstance(ev, AgentStream):
+        toughts += ev.delta
+
+    final_result = await handler
+    final += str(final_result)
+  finally:
+    trace.finish()
+    # Cancelled, e.g. by gaia_batch's timeout, while the agent was still working
+    if not handler.done():
+      await handler.cancel_run()
+  # Tokens of the history before and after compaction, and of the last prompt per part, go into the answer record
+  tracer.finish(final.strip(), timing=trace.summary(), history=memory.last_report, prompt=agent.formatter.last_breakdown)
+  return toughts.strip(), tool_calls.strip(), final.strip()
+
+
+def stats_report():
+  # Tokens the compact observations saved and how pages were fetched so far, for the debug panel
+  return "\n".join(report for report in (savings_report(), fetch_report()) if report)
+
+
+def build_ui():
+  import gradio as gr
+
+  with gr.Blocks(fill_height=True) as gradio_ui:
+    gr.Markdown("# Gaia Benchmark Agent")
+    with gr.Row():
+      chatbot = gr.Chatbot(type="messages", show_copy_button=True)
+      with gr.Column(visible=False) as right_column:
+        thoughts_box = gr.Textbox(label="🧠 Agent Thoughts", lines=8)
+        tools_box = gr.Textbox(label="🔧 Tool Calls", lines=8)
+        file_download = gr.File(label="📅 ICS-file", visible=False)
+        stats_box = gr.Textbox(label="📊 Stats", lines=4)
+
+    msg = gr.Textbox(label="Your message")
+    send_btn = gr.Button("Send")
+    toggle_btn = gr.Button("Toggle Debug View")
+
+
+    async def respond(user_input, chat_history):
+      thoughts, tools, final = await run_agent(user_input)
+      chat_history.append({"role": "user", "content": user_input})
+      chat_history.append({"role": "assistant", "content": final})
+      download_path = None
+      file_output = gr.update(value=None, visible=False)
+      if ".ics" in tools:
+        for line in tools.splitlines():
+          if ".ics" in line:
+            potential = line.split("=>")[-1].strip()
+            if os.path.exists(potential):
+              file_output = gr.update(value=potential, visible=True)
+              break
+
+      return chat_history, thoughts, tools, "", file_output, stats_report()
+
+
+    outputs = [chatbot, thoughts_box, tools_box, msg, file_download, stats_box]
+    send_btn.click(fn=respond, inputs=[msg, chatbot], outputs=outputs)
+    msg.submit(fn=respond, inputs=[msg, chatbot], outputs=outputs)
+
+    # Keep track of visibility state
+    show_debug = gr.State(value=True)
+
+    def toggle_debug_view(show):
+      return gr.update(visible=not show), not show
+
+    toggle_btn.click(fn=toggle_debug_view, inputs=[show_debug], outputs=[right_column, show_debug])
+  return gradio_ui
 
 if __name__ == "__main__":
-  gradio_ui.launch(inbrowser=True)
\ No newline at end of file
+  try:
+    build_ui().launch(inbrowser=True)
+  finally:
+    shutdown_browser_pool()
@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+
+from dotenv import load_dotenv
+
+# Headless GAIA runs: every question gets its own agent, context and memory,
+# N questions run concurrently, results are appended to a JSONL file (so an
+# interrupted run can be resumed) and scored against an optional answer key.
+#
+#   python gaia_batch.py --concurrency 4 --answers metadata.jsonl
+
+QUESTIONS_FILE = "gaia_questions.txt"
+RESULTS_FILE = "gaia_results.jsonl"
+REPORT_FILE = "gaia_report.json"
+
+
+def load_questions(path: str = QUESTIONS_FILE) -> list[str]:
+    '''
+    Questions are double quoted blocks separated by blank lines ("" inside is a quote).
+    A block only ends at a blank line after a closing quote, since questions contain blank lines.
+    '''
+    blocks, block = [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f.read().splitlines():
+            if not line.strip() and block and block[-1].rstrip().endswith('"'):
+                blocks.append("\n".join(block))
+                block = []
+            elif line.strip() or block:
+                block.append(line)
+    if block:
+        blocks.append("\n".join(block))
+    questions = []
+    for block in blocks:
+        block = block.strip()
+        if block.startswith('"') and block.endswith('"'):
+            block = block[1:-1]
+        questions.append(block.replace('""', '"').strip())
+    return questions
+
+
+def question_id(question: str) -> str:
+    return hashlib.sha1(question.encode("utf-8")).hexdigest()[:10]
+
+
+def load_answer_key(path: str) -> dict[str, str]:
+    '''
+    Answers by question id, from a JSON object {question or id: answer} or
+    JSONL like GAIA's metadata.jsonl ("Question" / "Final answer").
+    '''
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if path.endswith(".jsonl"):
+        rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+        pairs = [(r.get("Question") or r.get("question"), r.get("Final answer") or r.get("answer")) for r in rows]
+    else:
+        pairs = list(json.loads(text).items())
+    key = {}
+    for question, answer in pairs:
+        if question is not None and answer is not None:
+            key[question if re.fullmatch(r"[0-9a-f]{10}", question) else question_id(question.strip())] = str(answer)
+    return key
+
+
+# Answer normalization following the rules of gaia_system_prompt
+
+def extract_answer(text: str) -> str:
+    matches = re.findall(r"Answer:\s*(.*)", text)
+    answer = matches[-1] if matches else text
+    return answer.strip().strip("[]").strip()
+
+
+def normalize_number(text: str):
+    text = text.replace("$", "").replace("%", "").replace(",", "").strip()
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def normalize_string(text: str) -> str:
+    text = text.lower().strip()
+    text = re.sub(r"^(the|a|an)\s+", "", text)
+    return re.sub(r"[\W_]+", "", text)
+
+
+def is_correct(answer: str, truth: str) -> bool:
+    # Lists first: normalize_number() drops commas, which would read "1,2" as 12
+    if "," in truth or ";" in truth:
+        answers = re.split(r"[,;]", answer)
+        truths = re.split(r"[,;]", truth)
+        return len(answers) == len(truths) and all(is_correct(a, t) for a, t in zip(answers, truths))
+    if normalize_number(truth) is not None:
+        return normalize_number(answer) == normalize_number(truth)
+    return normalize_string(answer) == normalize_string(truth)
+
+
+# Running
+
+async def run_question(question: str, timeout: float) -> dict:
+    from llama_index.core.agent.workflow import AgentOutput, ToolCallResult
+    from llama_index.core.callbacks import CallbackManager, TokenCountingHandler
+    from llama_index.core.workflow import Context
+    from llama_index.llms.openai import OpenAI
+
+    import gaia
+    from compact_memory import CompactMemory
+    from tokens import encode
+
+    counter = TokenCountingHandler(tokenizer=encode)
+    llm = OpenAI(model="gpt-4o", callback_manager=CallbackManager([counter]))
+    agent = gaia.build_agent(llm)
+    memory = CompactMemory.from_defaults()
+    counts = {"llm_calls": 0, "tool_calls": 0}
+
+    def count(ev):
+        if isinstance(ev, AgentOutput):
+            counts["llm_calls"] += 1
+        elif isinstance(ev, ToolCallResult):
+            counts["tool_calls"] += 1
+
+    start = time.perf_counter()
+    result = {"id": question_id(question), "question": question}
+    try:
+        _, _, final = await asyncio.wait_for(
+            gaia.run_agent(question, agent=agent, ctx=Context(agent), memory=memory, on_event=count), timeout
+        )
+        result["output"] = final
+        result["answer"] = extract_answer(final)
+    except asyncio.TimeoutError:
+        result["error"] = f"timed out after {timeout:.0f} s"
+    except Exception as e:
+        result["error"] = repr(e)
+    result.update(counts)
+    result["prompt_tokens"] = counter.prompt_llm_token_count
+    result["completion_tokens"] = counter.completion_llm_token_count
+    result["wall_time"] = round(time.perf_counter() - start, 2)
+    return result
+
+
+def load_results(path: str) -> dict[str, dict]:
+    results = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    results[record["id"]] = record
+    return results
+
+
+async def run_batch(questions: list[str], results_path: str, concurrency: int, timeout: float) -> dict[str, dict]:
+    results = load_results(results_path)
+    # Questions that already have an answer are not asked again, failed ones are
+    todo = [q for q in questions if "answer" not in results.get(question_id(q), {})]
+    print(f"{len(questions) - len(todo)} of {len(questions)} questions already answered, running {len(todo)}")
+    semaphore = asyncio.Semaphore(concurrency)
+    write_lock = asyncio.Lock()
+
+    async def worker(question: str):
+        async with semaphore:
+            result = await run_question(question, timeout)
+        async with write_lock:
+            with open(results_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+            results[result["id"]] = result
+        print(f"[{result['id']}] {result['wall_time']:>6.1f} s  {result.get('answer', result.get('error'))}")
+
+    await asyncio.gather(*(worker(q) for q in todo))
+    return results
+
+
+def build_report(questions: list[str], results: dict[str, dict], answer_key: dict[str, str]) -> dict:
+    rows = []
+    for question in questions:
+        result = dict(results.get(question_id(question), {"id": question_id(question), "error": "not run"}))
+        result.pop("output", None)
+        truth = answer_key.get(result["id"])
+        if truth is not None:
+            result["expected"] = truth
+            result["correct"] = "answer" in result and is_correct(result["answer"], truth)
+        rows.append(result)
+    totals = {key: sum(r.get(key, 0) for r in rows)
+              for key in ("wall_time", "llm_calls", "tool_calls", "prompt_tokens", "completion_tokens")}
+    scored = [r for r in rows if "correct" in r]
+    totals["answered"] = sum("answer" in r for r in rows)
+    if scored:
+        totals["correct"] = sum(r["correct"] for r in scored)
+        totals["accuracy"] = totals["correct"] / len(scored)
+    return {"questions": rows, "totals": totals}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the GAIA questions without the UI.")
+    parser.add_argument("--questions", default=QUESTIONS_FILE)
+    parser.add_argument("--answers", help="answer key (.json or .jsonl) to score against")
+    parser.add_argument("--results", default=RESULTS_FILE, help="JSONL file the results are appended to")
+    parser.add_argument("--report", default=REPORT_FILE)
+    parser.add_argument("--concurrency", type=int, default=4, help="questions in flight at once")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds per question")
+    args = parser.parse_args()
+
+    load_dotenv()
+    questions = load_questions(args.questions)
+    answer_key = load_answer_key(args.answers) if args.answers else {}
+    started = time.perf_counter()
+    results = asyncio.run(run_batch(questions, args.results, args.concurrency, args.timeout))
+    report = build_report(questions, results, answer_key)
+    report["totals"]["batch_wall_time"] = round(time.perf_counter() - started, 2)
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    totals = report["totals"]
+    print(f"\n{totals['answered']} of {len(questions)} answered in {totals['batch_wall_time']} s, "
+          f"{totals['llm_calls']} LLM calls, {totals['tool_calls']} tool calls, "
+          f"{totals['prompt_tokens']} prompt + {totals['completion_tokens']} completion tokens")
+    if "accuracy" in totals:
+        print(f"accuracy: {totals['correct']} correct ({totals['accuracy']:.1%})")
+    print(f"report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
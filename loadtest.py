@@ -0,0 +1,417 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Optional
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+
+from bench_tools import lag_probe
+from cassette import git_revision
+
+# Load test of the Gradio app: N simulated users send the scripted dialogues of
+# bench_dialogues.json through respond() at the same time. The LLM is a local
+# mock of the OpenAI chat API that streams ReAct steps at a set token rate, and
+# search, weather and pages come from stub backends with a fixed latency, so
+# only the app itself is measured. Every number of users runs in a fresh process
+# with empty caches and reports throughput, turn latency percentiles, event
+# loop lag and peak memory.
+#
+#   python loadtest.py run --users 1 2 4 8 16 --token-rate 50
+#   python loadtest.py mock-llm --port 8400
+#   OPENAI_API_BASE=http://127.0.0.1:8400/v1 python app.py
+
+DIALOGUES_FILE = "bench_dialogues.json"
+RESULTS_DIR = "loadtest_results"
+# Events on every stub category page, half of them today and half tomorrow
+STUB_EVENTS = 12
+PAGE_WORDS = 600
+
+CITY = re.compile(r"\b(?:in|near|around|nach)\s+([A-ZÄÖÜ][\w-]+)")
+EVENT_URL = re.compile(r"https?://[^\s|]+/events?/[^\s|]+")
+EVENT_NAME = re.compile(r"^\d+\. ([^|]+?) \|", re.MULTILINE)
+TOKEN = re.compile(r"\s*\S+")
+OBSERVATION = "Observation:"
+
+
+# Mock LLM
+
+
+def _text(message: dict) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+
+def react_step(messages: list[dict]) -> str:
+    '''
+    The next ReAct step for a chat: a tool call while the turn's plan has one left, the answer after that.
+    '''
+    turn = max((i for i, m in enumerate(messages) if m["role"] == "user" and not _text(m).startswith(OBSERVATION)),
+               default=0)
+    question = _text(messages[turn])
+    observations = [_text(m) for m in messages[turn + 1:] if m["role"] == "user"]
+    # Follow-up questions are about the city of an earlier one
+    cities = [CITY.search(_text(m)) for m in messages[:turn + 1] if m["role"] == "user"]
+    city = next((c.group(1) for c in reversed(cities) if c), "Berlin")
+    day = "tomorrow" if re.search(r"tomorrow|morgen|weekend", question, re.IGNORECASE) else "today"
+    lowered = question.lower()
+
+    plan = []
+    if lowered.startswith("remember"):
+        plan.append(("StoreFact", {"new_fact": question}))
+    else:
+        if re.search(r"weather|outside|outdoor|wetter", lowered):
+            plan.append(("GetWeather", {"city": city}))
+        plan.append(("BrowseRausgegangenDeCategories", {"city": city.lower(), "category": "auto", "date": day,
+                                                        "query": question[:80]}))
+        plan.append(("ExtractAndReadWebPage", None))
+
+    if len(observations) < len(plan):
+        name, kwargs = plan[len(observations)]
+        if kwargs is None:
+            # Read the first event the previous step found
+            urls = EVENT_URL.findall(observations[-1]) if observations else []
+            kwargs = {"url": urls[0], "query": question[:80]} if urls else None
+        if kwargs is not None:
+            return (f"Thought: The current language of the user is: English. I need to use a tool to help me answer the question.\n"
+                    f"Action: {name}\nAction Input: {json.dumps(kwargs, ensure_ascii=False)}")
+
+    names = EVENT_NAME.findall("\n".join(observations))[:3]
+    found = f"these events: {', '.join(names)}" if names else "a few options"
+    return ("Thought: I can answer without using any more tools. I'll use the user's language to answer\n"
+            f"Answer: For {city} {day} I found {found}. The first one looks like the best match for what you asked, "
+            "it is close to the city centre and tickets are still available at the door. "
+            "Let me know if you want more details or a calendar entry for one of them.")
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    '''
+    POST .../chat/completions in the OpenAI format, streamed (server-sent events) or not.
+    '''
+
+    token_rate: float = 50.0
+    first_token: float = 0.3
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+        text = react_step(body.get("messages", []))
+        tokens = TOKEN.findall(text)
+        time.sleep(self.first_token)
+        if not body.get("stream"):
+            time.sleep(len(tokens) / self.token_rate)
+            self._send_json({"id": "mock", "object": "chat.completion", "created": int(time.time()),
+                             "model": body.get("model", "mock"),
+                             "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                                          "finish_reason": "stop"}],
+                             "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)}})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        try:
+            for i, token in enumerate(tokens):
+                if i:
+                    time.sleep(1 / self.token_rate)
+                delta = {"role": "assistant", "content": token} if i == 0 else {"content": token}
+                self._send_chunk(body, delta, None)
+            self._send_chunk(body, {}, "stop")
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the run
+            pass
+
+    def _send_chunk(self, body: dict, delta: dict, finish_reason: Optional[str]):
+        chunk = {"id": "mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                 "model": body.get("model", "mock"), "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+        self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def _send_json(self, data: dict):
+        payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_llm(port: int = 0, token_rate: float = 50.0, first_token: float = 0.3) -> ThreadingHTTPServer:
+    '''
+    Serve the mock LLM on 127.0.0.1:port (0 picks a free port) in a background thread.
+    '''
+    handler = type("Handler", (MockLLMHandler,), {"token_rate": token_rate, "first_token": first_token})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-llm", daemon=True).start()
+    return server
+
+
+# Stub backends
+
+
+class StubSearch:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def text(self, query: str, max_results: int) -> list[dict]:
+        time.sleep(self.latency)
+        slug = re.sub(r"\W+", "-", query.lower()).strip("-")
+        return [{"title": f"{query} ({i})", "url": f"https://example.org/{slug}/{i}",
+                 "snippet": f"Everything about {query}, part {i}."} for i in range(1, max_results + 1)]
+
+
+class StubWeather:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def fetch(self, city: str) -> dict:
+        from datetime import date, timedelta
+
+        time.sleep(self.latency)
+        hourly = [{"time": t, "tempC": str(12 + i), "weatherDesc": [{"value": "Partly cloudy"}], "chanceofrain": "20",
+                   "windspeedKmph": "11"} for i, t in enumerate(("900", "1200", "1800", "2100"))]
+        return {
+            "nearest_area": [{"areaName": [{"value": city}]}],
+            "current_condition": [{"temp_C": "14", "FeelsLikeC": "13", "weatherDesc": [{"value": "Sunny"}],
+                                   "windspeedKmph": "9"}],
+            "weather": [{"date": (date.today() + timedelta(days=d)).isoformat(), "mintempC": "9", "maxtempC": "18",
+                         "hourly": hourly} for d in range(3)],
+        }
+
+
+class StubPages:
+    '''
+    Stands in for a cassette (see cassette.use_cassette) and answers every page
+    fetch with a generated page: category pages with JSON-LD events, event and
+    other pages with some paragraphs of text. Search and weather calls go
+    through to their (stub) backends.
+    '''
+
+    mode = "stub"
+
+    def __init__(self, latency: float, events: int = STUB_EVENTS):
+        self.latency = latency
+        self.events = events
+
+    def call(self, kind, key, fn, encode=None, decode=lambda value: value):
+        if kind != "page":
+            return fn()
+        time.sleep(self.latency)
+        url = key.split(" ", 1)[1]
+        html, text = self.category_page(url) if "/kategorie/" in url else self.text_page(url)
+        return decode({"url": url, "html": html, "text": text, "tier": "http", "headers": {}})
+
+    def save(self):
+        pass
+
+    def category_page(self, url: str) -> tuple[str, str]:
+        from datetime import date, timedelta
+
+        parts = urlsplit(url).path.strip("/").split("/")
+        city, category = parts[0], parts[-1]
+        items = [{"@type": "Event", "name": f"{category.replace('-', ' ').title()} {city.title()} #{i}",
+                  "url": f"/events/{category}-{city}-{i}", "startDate":
+                  f"{date.today() + timedelta(days=i % 2)}T{18 + i % 5}:00:00",
+                  "location": {"name": f"Venue {i}"}, "offers": {"price": str(5 + i), "priceCurrency": "EUR"}}
+                 for i in range(1, self.events + 1)]
+        html = f'<html><body><script type="application/ld+json">{json.dumps(items)}</script></body></html>'
+        return html, "\n".join(item["name"] for item in items)
+
+    def text_page(self, url: str) -> tuple[str, str]:
+        sentence = (f"The event at {url} starts at 20:00, doors open at 19:30 and tickets cost 12 € at the door. "
+                    "The venue is five minutes from the next tram stop and has a bar and a small garden. ")
+        paragraphs = [sentence * 4] * max(1, PAGE_WORDS // 150)
+        html = "<html><body><main>" + "".join(f"<p>{p}</p>" for p in paragraphs) + "</main></body></html>"
+        return html, "\n\n".join(paragraphs)
+
+
+# One number of users, in the child process
+
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+async def simulated_user(n: int, respond, dialogues: list[dict], rounds: int, think: float, results: dict):
+    for r in range(rounds):
+        dialogue = dialogues[(n + r) % len(dialogues)]
+        request = SimpleNamespace(session_hash=f"load-{n}-{r}", username=f"load-{n}")
+        history = []
+        for message in dialogue["turns"]:
+            started, first_answer = time.perf_counter(), None
+            try:
+                async for frame in respond(message, history, request):
+                    history = frame[0]
+                    reply = history[-1]["content"] if history else ""
+                    if first_answer is None and reply and not reply.startswith(("🤔", "🔧")):
+                        first_answer = time.perf_counter() - started
+                results["turn"].add(time.perf_counter() - started)
+                if first_answer is not None:
+                    results["first_answer"].add(first_answer)
+            except Exception as e:
+                results["errors"].append(repr(e))
+            await asyncio.sleep(think)
+
+
+async def drive(respond, users: int, dialogues: list[dict], rounds: int, think: float) -> dict:
+    from metrics import Histogram
+
+    results = {"turn": Histogram(), "first_answer": Histogram(), "errors": []}
+    lags: list[float] = []
+    probe = asyncio.create_task(lag_probe(lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(simulated_user(n, respond, dialogues, rounds, think, results) for n in range(users)))
+    elapsed = time.perf_counter() - started
+    probe.cancel()
+
+    lag = Histogram()
+    for value in lags:
+        lag.add(value)
+    return {
+        "wall_time": round(elapsed, 3),
+        "turns": results["turn"].count,
+        "errors": len(results["errors"]),
+        "first_errors": results["errors"][:3],
+        "throughput": round(results["turn"].count / elapsed, 3),
+        "turn": results["turn"].summary(),
+        "first_answer": results["first_answer"].summary(),
+        "loop_lag": {**lag.summary(), "max_ms": round(max(lags, default=0) * 1000, 1)},
+    }
+
+
+def run_level(users: int, rounds: int, think: float, latency: float) -> dict:
+    from cassette import use_cassette
+    from search import set_search_backend
+    from weather import set_weather_backend
+
+    import app
+    import metrics
+
+    with open(DIALOGUES_FILE, "r", encoding="utf-8") as f:
+        dialogues = json.load(f)
+    set_search_backend(StubSearch(latency))
+    set_weather_backend(StubWeather(latency))
+    respond = next(block.fn for block in app.build_ui().fns.values() if getattr(block.fn, "__name__", "") == "respond")
+    # Memory of the loaded app before the first user
+    base_rss = peak_rss_mb()
+    with use_cassette(StubPages(latency)):
+        result = {"users": users, **asyncio.run(drive(respond, users, dialogues, rounds, think))}
+
+    latency_ms = metrics.snapshot()["latency"]
+    result["llm"] = latency_ms.get("llm:llm")
+    result["tools"] = {key.split(":", 1)[1]: h for key, h in latency_ms.items() if key.startswith("tool:")}
+    result["base_rss_mb"], result["peak_rss_mb"] = base_rss, peak_rss_mb()
+    return result
+
+
+# Driver
+
+
+def run_in_child(users: int, args, llm_url: str) -> dict:
+    '''
+    Run one number of users in a new process with its own empty caches, fact store and logs.
+    '''
+    with tempfile.TemporaryDirectory(prefix="loadtest-") as tmp:
+        env = dict(os.environ, CACHE_DIR=os.path.join(tmp, "cache"), FACTS_DB=os.path.join(tmp, "facts.sqlite"),
+                   PROMPT_LOG=os.path.join(tmp, "prompt_tokens.jsonl"), METRICS_FILE=os.path.join(tmp, "metrics.json"),
+                   METRICS_PORT="0", OPENAI_API_BASE=llm_url, ANSWER_CACHE="1" if args.answer_cache else "0")
+        env.setdefault("OPENAI_API_KEY", "loadtest")
+        command = [sys.executable, __file__, "level", str(users), "--rounds", str(args.rounds),
+                   "--think", str(args.think), "--backend-latency", str(args.backend_latency)]
+        process = subprocess.run(command, env=env, capture_output=True, text=True)
+    lines = process.stdout.strip().splitlines()
+    try:
+        return json.loads(lines[-1])
+    except (IndexError, ValueError):
+        return {"users": users, "error": f"exit code {process.returncode}: {process.stderr.strip()[-500:]}"}
+
+
+def print_result(result: dict):
+    if "error" in result:
+        print(f"{result['users']:>5}  error: {result['error']}")
+        return
+    turn, first, lag = result["turn"], result["first_answer"], result["loop_lag"]
+    print(f"{result['users']:>5} {result['turns']:>6} {result['errors']:>6} {result['throughput']:>8.2f} "
+          f"{turn['p50_ms'] or 0:>8.0f} {turn['p95_ms'] or 0:>8.0f} {turn['p99_ms'] or 0:>8.0f} "
+          f"{first['p95_ms'] or 0:>9.0f} {lag['p99_ms'] or 0:>8.1f} {lag['max_ms']:>8.1f} "
+          f"{result['peak_rss_mb'] or 0:>8.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Gradio app with simulated users and a mock LLM.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run the dialogues with more and more concurrent users")
+    run.add_argument("--users", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    run.add_argument("--token-rate", type=float, default=50.0, help="tokens per second the mock LLM streams")
+    run.add_argument("--first-token", type=float, default=0.3, help="seconds before the mock LLM's first token")
+    run.add_argument("--llm-url", help="OpenAI compatible API to use instead of the mock, e.g. http://host:8400/v1")
+    run.add_argument("--out", help=f"results file (default {RESULTS_DIR}/<revision>.json)")
+    level = commands.add_parser("level", help="run one number of users in this process and print its result")
+    level.add_argument("users", type=int)
+    for sub in (run, level):
+        sub.add_argument("--rounds", type=int, default=1, help="dialogues per user")
+        sub.add_argument("--think", type=float, default=1.0, help="seconds a user waits between turns")
+        sub.add_argument("--backend-latency", type=float, default=0.3, help="seconds a search, weather or page call takes")
+    run.add_argument("--answer-cache", action="store_true", help="let repeated first questions hit the answer cache")
+    mock = commands.add_parser("mock-llm", help="only serve the mock LLM")
+    mock.add_argument("--port", type=int, default=8400)
+    mock.add_argument("--token-rate", type=float, default=50.0)
+    mock.add_argument("--first-token", type=float, default=0.3)
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.command == "mock-llm":
+        server = start_mock_llm(args.port, args.token_rate, args.first_token)
+        print(f"mock LLM on http://127.0.0.1:{server.server_address[1]}/v1")
+        threading.Event().wait()
+    elif args.command == "level":
+        print(json.dumps(run_level(args.users, args.rounds, args.think, args.backend_latency), ensure_ascii=False))
+    else:
+        llm_url = args.llm_url
+        if llm_url is None:
+            server = start_mock_llm(0, args.token_rate, args.first_token)
+            llm_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+        print(f"{'users':>5} {'turns':>6} {'errors':>6} {'turns/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+              f"{'1st ans':>9} {'lag p99':>8} {'lag max':>8} {'peak MB':>8}")
+        results = []
+        for users in args.users:
+            result = run_in_child(users, args, llm_url)
+            print_result(result)
+            results.append(result)
+        revision = git_revision() or "unknown"
+        out = args.out or os.path.join(RESULTS_DIR, f"{revision}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump({"revision": revision, "llm": args.llm_url or "mock", "token_rate": args.token_rate,
+                       "backend_latency": args.backend_latency, "think": args.think, "results": results},
+                      f, indent=2, ensure_ascii=False)
+        print(f"results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Optional
+
+from tokens import count_tokens
+
+# Timing spans for turns, agent steps, LLM calls, tool calls and fetches.
+#
+# Every finished span goes into a latency histogram per (kind, name). Spans
+# opened while a turn Trace is active (see start_trace) are also kept on that
+# trace, which renders them as a waterfall for the debug panel.
+# The histograms are served as JSON on http://127.0.0.1:METRICS_PORT/metrics
+# and written to METRICS_FILE when the process exits.
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+METRICS_FILE = os.getenv("METRICS_FILE", "metrics.json")
+SAMPLES = 2048
+WATERFALL_WIDTH = 30
+
+
+@dataclass
+class Span:
+    name: str
+    kind: str
+    start: float
+    end: Optional[float] = None
+    attrs: dict = field(default_factory=dict)
+    depth: int = 0
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+
+class Histogram:
+    '''
+    Count, total and percentiles over the last SAMPLES values.
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples: deque = deque(maxlen=SAMPLES)
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def summary(self) -> dict:
+        values = sorted(self.samples)
+
+        def percentile(q: float) -> Optional[float]:
+            return round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 1) if values else None
+
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 1) if self.count else None,
+            "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+        }
+
+
+_lock = threading.Lock()
+_histograms: dict[tuple[str, str], Histogram] = defaultdict(Histogram)
+_counters: dict[str, float] = defaultdict(float)
+# Extra sections of the snapshot, e.g. fetch.fetch_stats
+_sources: dict[str, Callable[[], Any]] = {}
+_started = time.time()
+
+
+def observe(kind: str, name: str, seconds: float):
+    with _lock:
+        _histograms[(kind, name)].add(seconds)
+
+
+def count(name: str, value: float = 1):
+    with _lock:
+        _counters[name] += value
+
+
+def register_source(name: str, fn: Callable[[], Any]):
+    _sources[name] = fn
+
+
+class Trace:
+    '''
+    The spans of one turn. on_event() turns the agent's stream events into
+    step and LLM call spans; tool and fetch spans are added by span().
+    '''
+
+    def __init__(self, name: str = "turn"):
+        self.root = Span(name, "turn", time.perf_counter())
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+        self._step: Optional[Span] = None
+        self._llm: Optional[Span] = None
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def _close(self, span: Optional[Span], now: float):
+        if span is not None and span.end is None:
+            span.end = now
+            # All steps share one histogram
+            observe(span.kind, span.kind if span.kind == "step" else span.name, span.duration)
+
+    def on_event(self, ev):
+        from llama_index.core.agent.workflow import AgentInput, AgentOutput, AgentStream
+
+        now = time.perf_counter()
+        if isinstance(ev, AgentInput):
+            # A new LLM call starts the next step
+            self._close(self._step, now)
+            self._step = Span(f"step {sum(s.kind == 'step' for s in self.spans) + 1}", "step", now)
+            tokens = sum(count_tokens(m.content or "") for m in ev.input)
+            self._llm = Span("llm", "llm", now, attrs={"input_tokens": tokens}, depth=1)
+            self.add(self._step)
+            self.add(self._llm)
+            count("llm.input_tokens", tokens)
+        elif isinstance(ev, AgentStream) and self._llm is not None and "ttft_s" not in self._llm.attrs:
+            self._llm.attrs["ttft_s"] = round(now - self._llm.start, 2)
+        elif isinstance(ev, AgentOutput) and self._llm is not None:
+            tokens = count_tokens(ev.response.content or "")
+            self._llm.attrs["output_tokens"] = tokens
+            count("llm.output_tokens", tokens)
+            self._close(self._llm, now)
+            self._llm = None
+
+    def finish(self):
+        now = time.perf_counter()
+        self._close(self._llm, now)
+        self._close(self._step, now)
+        self._close(self.root, now)
+
+    def summary(self) -> dict:
+        '''
+        Seconds spent per kind of span (top level spans only for tools and fetches).
+        '''
+        totals = defaultdict(float)
+        for span in self.spans:
+            if span.kind != "step":
+                totals[span.kind] += span.duration
+        totals = {kind: round(seconds, 2) for kind, seconds in totals.items()}
+        totals["turn"] = round(self.root.duration, 2)
+        return totals
+
+    def waterfall(self, width: int = WATERFALL_WIDTH) -> str:
+        total = max(self.root.duration, 1e-6)
+        lines = [f"{self.root.name} {total:.2f} s"]
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        for span in spans:
+            offset = span.start - self.root.start
+            first = min(width - 1, int(offset / total * width))
+            length = max(1, round(span.duration / total * width))
+            bar = "·" * first + "█" * min(length, width - first)
+            attrs = ", ".join(f"{k} {v}" for k, v in span.attrs.items())
+            label = "  " * span.depth + span.name + (f" ({attrs})" if attrs else "")
+            lines.append(f"{offset:6.2f} |{bar:<{width}}| {span.duration:6.2f} s  {span.kind:<6} {label}")
+        return "\n".join(lines)
+
+
+current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+def start_trace(name: str = "turn") -> tuple[Trace, contextvars.Token]:
+    trace = Trace(name)
+    return trace, current_trace.set(trace)
+
+
+@contextmanager
+def span(name: str, kind: str, **attrs):
+    '''
+    Time the block as a span: into the histogram of (kind, name) and, inside a turn, onto its trace.
+    '''
+    parent = _current_span.get()
+    current = Span(name, kind, time.perf_counter(), attrs=attrs, depth=parent.depth + 1 if parent else 1)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end = time.perf_counter()
+        observe(kind, name, current.duration)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add(current)
+
+
+def annotate(**attrs):
+    '''
+    Add attributes (e.g. cache="hit") to the innermost open span.
+    '''
+    current = _current_span.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def snapshot() -> dict:
+    with _lock:
+        histograms = {f"{kind}:{name}": h.summary() for (kind, name), h in sorted(_histograms.items())}
+        counters = dict(_counters)
+    data = {"uptime_s": round(time.time() - _started), "latency": histograms, "counters": counters}
+    for name, fn in list(_sources.items()):
+        try:
+            data[name] = fn()
+        except Exception as e:
+            data[name] = {"error": repr(e)}
+    return data
+
+
+def dump(path: str = METRICS_FILE):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f, indent=2, default=str)
+    os.replace(tmp, path)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("/metrics", "/metrics.json"):
+            self.send_error(404)
+            return
+        body = json.dumps(snapshot(), indent=2, default=str).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+
+
+def start_metrics_server(port: int = METRICS_PORT) -> Optional[ThreadingHTTPServer]:
+    '''
+    Serve snapshot() on 127.0.0.1:port/metrics in a background thread (port 0 disables it).
+    '''
+    global _server
+    if _server is None and port:
+        try:
+            _server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        except OSError:
+            return None
+        threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+        atexit.register(dump)
+    return _server
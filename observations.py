@@ -0,0 +1,109 @@
+import re
+import threading
+from collections import defaultdict
+from typing import Optional
+
+from metrics import annotate, register_source
+from tokens import count_tokens, truncate_tokens
+
+# Formatting of tool outputs into the "Observation: ..." strings the ReAct agent sees.
+
+# Upper bound of tokens per observation, by tool name
+TOOL_TOKEN_CAPS = {
+    "duckduckgo_websearch": 700,
+    "ExtractAndReadWebPage": 4000,
+    "ReadWebPages": 5000,
+    "BrowseRausgegangenDeCategories": 900,
+    "GetWeather": 300,
+    "ClassifyQuery": 100,
+}
+DEFAULT_TOKEN_CAP = 1000
+SNIPPET_CHARS = 240
+# Size of an observation once it is old enough to be digested (see compact_memory.py)
+DIGEST_TOKENS = 120
+DIGEST_RECORDS = 10
+DIGEST_LINE_CHARS = 160
+# Numbered records: events, search results and the sections of ReadWebPages
+RECORD_LINE = re.compile(r"^\[?\d+[.\]] ")
+PASSAGE_LINE = re.compile(r"^\[chars \d+-\d+\]$")
+
+_lock = threading.Lock()
+_stats = defaultdict(lambda: {"calls": 0, "raw_chars": 0, "chars": 0, "raw_tokens": 0, "tokens": 0})
+
+
+def observation(text: str, tool: str, raw: Optional[str] = None) -> str:
+    '''
+    Cap `text` to the tool's token budget and wrap it as an observation.
+    `raw` is what the tool would have returned unformatted; it is only used
+    to account for the saved characters and tokens.
+    '''
+    cap = TOOL_TOKEN_CAPS.get(tool, DEFAULT_TOKEN_CAP)
+    tokens = count_tokens(text)
+    raw_chars, raw_tokens = (len(text), tokens) if raw is None else (len(raw), count_tokens(raw))
+    if tokens > cap:
+        text = truncate_tokens(text, cap) + f"\n[... truncated, {tokens - cap} more tokens]"
+        tokens = count_tokens(text)
+    with _lock:
+        stats = _stats[tool]
+        stats["calls"] += 1
+        stats["raw_chars"] += raw_chars
+        stats["chars"] += len(text)
+        stats["raw_tokens"] += raw_tokens
+        stats["tokens"] += tokens
+    annotate(output_tokens=tokens)
+    return "Observation: " + text + "\n"
+
+
+def format_results(results: list[dict]) -> str:
+    '''
+    Numbered "title - url" lines with a short snippet below each.
+    '''
+    if not results:
+        return "No results found."
+    lines = []
+    for i, result in enumerate(results, 1):
+        snippet = " ".join((result.get("snippet") or "").split())
+        if len(snippet) > SNIPPET_CHARS:
+            snippet = snippet[:SNIPPET_CHARS].rsplit(" ", 1)[0] + " ..."
+        lines.append(f"{i}. {result.get('title', '').strip()} - {result.get('url', '')}")
+        if snippet:
+            lines.append(f"   {snippet}")
+    return "\n".join(lines)
+
+
+def observation_stats() -> dict:
+    with _lock:
+        return {tool: dict(stats) for tool, stats in _stats.items()}
+
+
+def digest_observation(text: str, max_tokens: int = DIGEST_TOKENS) -> str:
+    '''
+    Short version of an observation: its first line and up to DIGEST_RECORDS of
+    its numbered records (events, search results, pages) without snippets or
+    passages, or the first `max_tokens` tokens if it has no records.
+    '''
+    tokens = count_tokens(text)
+    lines = [line.strip() for line in text.strip().splitlines() if line.strip() and not PASSAGE_LINE.match(line)]
+    if tokens <= max_tokens or not lines:
+        return text
+    records = [line for line in lines[1:] if RECORD_LINE.match(line)]
+    if records:
+        kept = [lines[0]] + records[:DIGEST_RECORDS]
+        digest = "\n".join(line if len(line) <= DIGEST_LINE_CHARS else line[:DIGEST_LINE_CHARS] + " ..." for line in kept)
+    else:
+        digest = truncate_tokens("\n".join(lines), max_tokens) + " ..."
+    return digest + f"\n[digest of a {tokens} token observation]"
+
+
+def savings_report() -> str:
+    '''
+    Characters and tokens saved per tool compared to the unformatted outputs.
+    '''
+    lines = []
+    for tool, s in sorted(observation_stats().items()):
+        lines.append(f"{tool}: {s['calls']} calls, saved {s['raw_chars'] - s['chars']} chars / "
+                     f"{s['raw_tokens'] - s['tokens']} tokens ({s['tokens']} of {s['raw_tokens']} tokens sent)")
+    return "\n".join(lines)
+
+
+register_source("observations", observation_stats)
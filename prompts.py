@@ -0,0 +1,162 @@
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import threading
+import time
+from collections import defaultdict
+from typing import Any, List, Optional, Sequence
+
+from llama_index.core.agent.react.formatter import ReActChatFormatter, get_react_tool_descriptions
+from llama_index.core.agent.react.types import BaseReasoningStep
+from llama_index.core.llms import ChatMessage
+from llama_index.core.tools import BaseTool
+from pydantic import Field, PrivateAttr
+
+from protocol import TraceWriter
+from tokens import count_tokens
+
+# System prompts built from named sections. The static sections (instructions
+# with the tool descriptions, rules, examples) come first and are the same
+# bytes on every call, so the provider can cache that prefix. The volatile
+# context (date, user facts) is filled into {context} at the very end, and
+# the conversation follows as messages.
+#
+#   python prompts.py report prompt_tokens.jsonl
+
+PROMPT_LOG = os.getenv("PROMPT_LOG", "prompt_tokens.jsonl")
+CONTEXT_SLOT = "{context}"
+
+_log: Optional[TraceWriter] = None
+_log_lock = threading.Lock()
+
+
+def get_prompt_log() -> TraceWriter:
+    global _log
+    with _log_lock:
+        if _log is None:
+            _log = TraceWriter(PROMPT_LOG)
+        return _log
+
+
+class PromptBuilder:
+    '''
+    `sections` are (name, text) pairs in prompt order; the texts are format
+    templates and may use {tool_desc} and {tool_names}. With `volatile`
+    section names, the header ends with {context}, filled per turn by context().
+    '''
+
+    def __init__(self, sections: list[tuple[str, str]], volatile: Sequence[str] = ()):
+        self.sections = sections
+        self.volatile = list(volatile)
+        self.section_tokens = {name: count_tokens(text) for name, text in sections}
+
+    def template(self) -> str:
+        text = "".join(text for _, text in self.sections)
+        if self.volatile:
+            text = text.rstrip() + "\n\n" + CONTEXT_SLOT
+        return text
+
+    def context(self, **values: str) -> str:
+        '''
+        The volatile sections as "## Title" blocks, always in the same order.
+        '''
+        blocks = []
+        for name in self.volatile:
+            value = values.get(name)
+            if value:
+                blocks.append(f"## {name.replace('_', ' ').title()}\n\n{value.strip()}")
+        return "\n\n".join(blocks) + "\n"
+
+    def formatter(self, name: str = "chat") -> "AccountingFormatter":
+        return AccountingFormatter(system_header=self.template(), builder=self, prompt_name=name)
+
+
+class AccountingFormatter(ReActChatFormatter):
+    '''
+    ReAct formatter that counts the tokens of every prompt by section and
+    writes the breakdown to the prompt log, one JSON line per LLM call.
+    '''
+
+    builder: Any = Field(default=None, exclude=True)
+    prompt_name: str = "chat"
+    _last: dict = PrivateAttr(default_factory=dict)
+
+    def format(self, tools: Sequence[BaseTool], chat_history: List[ChatMessage],
+               current_reasoning: Optional[List[BaseReasoningStep]] = None) -> List[ChatMessage]:
+        messages = super().format(tools, chat_history, current_reasoning)
+        system = messages[0].content or ""
+        context = self.context if self.context and system.endswith(self.context) else ""
+        prefix = system[:len(system) - len(context)]
+        reasoning = messages[1 + len(chat_history):]
+
+        sections = dict(self.builder.section_tokens) if self.builder is not None else {}
+        sections["tool_desc"] = count_tokens("\n".join(get_react_tool_descriptions(tools)))
+        breakdown = {
+            "prompt": self.prompt_name,
+            "prefix_hash": hashlib.sha1(prefix.encode("utf-8")).hexdigest()[:12],
+            "prefix": count_tokens(prefix),
+            "sections": sections,
+            "context": count_tokens(context),
+            "history": sum(count_tokens(m.content or "") for m in chat_history),
+            "reasoning": sum(count_tokens(m.content or "") for m in reasoning),
+        }
+        breakdown["total"] = breakdown["prefix"] + breakdown["context"] + breakdown["history"] + breakdown["reasoning"]
+        self._last = breakdown
+        get_prompt_log().write(dict(breakdown))
+        return messages
+
+    @property
+    def last_breakdown(self) -> dict:
+        return dict(self._last)
+
+    def describe(self) -> str:
+        b = self._last
+        if not b:
+            return "no prompt sent yet"
+        return (f"{b['total']} tokens: {b['prefix']} static prefix ({b['prefix_hash']}), {b['context']} context, "
+                f"{b['history']} history, {b['reasoning']} reasoning")
+
+
+def summarize(path: str = PROMPT_LOG) -> dict:
+    '''
+    Mean tokens per part and prompt for every day in the log.
+    '''
+    days = defaultdict(lambda: defaultdict(list))
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            day = time.strftime("%Y-%m-%d", time.localtime(record.get("ts", 0)))
+            parts = days[(day, record.get("prompt", "chat"))]
+            for key in ("prefix", "context", "history", "reasoning", "total"):
+                parts[key].append(record.get(key, 0))
+            parts["prefixes"].append(record.get("prefix_hash"))
+    report = {}
+    for (day, prompt), parts in sorted(days.items()):
+        report[f"{day} {prompt}"] = {
+            "calls": len(parts["total"]),
+            "distinct_prefixes": len(set(parts["prefixes"])),
+            **{key: round(statistics.mean(values)) for key, values in parts.items() if key != "prefixes"},
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Token usage of the agent prompts.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    report = commands.add_parser("report", help="mean tokens per part and day")
+    report.add_argument("path", nargs="?", default=PROMPT_LOG)
+    args = parser.parse_args()
+
+    if args.command == "report":
+        print(f"{'day / prompt':<20} {'calls':>6} {'prefixes':>8} {'prefix':>7} {'context':>8} {'history':>8} {'reasoning':>9} {'total':>7}")
+        for key, s in summarize(args.path).items():
+            print(f"{key:<20} {s['calls']:>6} {s['distinct_prefixes']:>8} {s['prefix']:>7} {s['context']:>8} "
+                  f"{s['history']:>8} {s['reasoning']:>9} {s['total']:>7}")
+
+
+if __name__ == "__main__":
+    main()
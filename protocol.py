@@ -0,0 +1,149 @@
+import argparse
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Optional
+
+# Append-only JSONL protocol of agent runs: one record per LLM step, tool call and answer.
+
+TRACE_FILE = "gaia_trace.jsonl"
+MAX_BYTES = 20 * 1024 * 1024
+BACKUPS = 5
+FLUSH_RECORDS = 50
+FLUSH_SECONDS = 2.0
+OUTPUT_CHARS = 2000
+
+
+def truncate(text: str, limit: int = OUTPUT_CHARS) -> str:
+    if len(text) <= limit:
+        return text
+    return text[:limit] + f"... [{len(text) - limit} more chars]"
+
+
+class TraceWriter:
+    '''
+    Buffers records and appends them as JSON lines. The file is rotated to
+    path.1 ... path.N once it grows beyond `max_bytes`.
+    '''
+
+    def __init__(self, path: str = TRACE_FILE, max_bytes: int = MAX_BYTES, backups: int = BACKUPS,
+                 flush_records: int = FLUSH_RECORDS, flush_seconds: float = FLUSH_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_records = flush_records
+        self.flush_seconds = flush_seconds
+        self._buffer: list[str] = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def write(self, record: dict):
+        record.setdefault("ts", time.time())
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._buffer.append(line)
+            due = time.monotonic() - self._last_flush >= self.flush_seconds
+            if len(self._buffer) >= self.flush_records or due:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        data = "\n".join(self._buffer) + "\n"
+        self._buffer.clear()
+        if os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_bytes:
+            self._rotate()
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(data)
+            f.flush()
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+
+class StepTracer:
+    '''
+    Turns the event stream of one agent run into trace records:
+    "question", one "llm" record per step (its thought text), one "tool"
+    record per tool call and a final "answer".
+    '''
+
+    def __init__(self, writer: TraceWriter, question: str, run_id: Optional[str] = None):
+        self.writer = writer
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.step = 0
+        self._started = time.perf_counter()
+        self._step_started = self._started
+        self._thought = ""
+        self._tool_started: dict[str, float] = {}
+        self._record("question", input=question)
+
+    def _record(self, kind: str, **fields):
+        self.writer.write({"run_id": self.run_id, "step": self.step, "type": kind, **fields})
+
+    def on_event(self, ev):
+        from llama_index.core.agent.workflow import AgentInput, AgentOutput, AgentStream, ToolCall, ToolCallResult
+
+        now = time.perf_counter()
+        if isinstance(ev, AgentInput):
+            self.step += 1
+            self._step_started = now
+            self._thought = ""
+        elif isinstance(ev, AgentStream):
+            self._thought += ev.delta
+        elif isinstance(ev, AgentOutput):
+            self._record("llm", thought=self._thought, duration_ms=round((now - self._step_started) * 1000))
+        elif isinstance(ev, ToolCall):
+            self._tool_started[ev.tool_id] = now
+        elif isinstance(ev, ToolCallResult):
+            started = self._tool_started.pop(ev.tool_id, now)
+            output = str(ev.tool_output)
+            self._record("tool", tool=ev.tool_name, kwargs=ev.tool_kwargs, output=truncate(output),
+                         output_chars=len(output), duration_ms=round((now - started) * 1000))
+
+    def finish(self, answer: str, **fields):
+        self._record("answer", output=answer, duration_ms=round((time.perf_counter() - self._started) * 1000), **fields)
+        self.writer.flush()
+
+
+def import_protocol(json_path: str, writer: TraceWriter) -> int:
+    '''
+    Convert the old gaia_protocol.json ([{"input", "output"}, ...]) into trace records.
+    '''
+    with open(json_path, "r", encoding="utf-8") as f:
+        messages = json.load(f)
+    for message in messages:
+        run_id = uuid.uuid4().hex[:12]
+        writer.write({"run_id": run_id, "step": 0, "type": "question", "input": message["input"], "imported": True})
+        writer.write({"run_id": run_id, "step": 0, "type": "answer", "output": message["output"], "imported": True})
+    writer.flush()
+    return len(messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tools for the JSONL agent protocol.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("import", help="import an old gaia_protocol.json")
+    convert.add_argument("json_path", nargs="?", default="gaia_protocol.json")
+    convert.add_argument("trace_path", nargs="?", default=TRACE_FILE)
+    args = parser.parse_args()
+
+    if args.command == "import":
+        count = import_protocol(args.json_path, TraceWriter(args.trace_path))
+        print(f"Imported {count} runs from {args.json_path} into {args.trace_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import contextvars
+import functools
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Protocol
+
+from cache import DiskCache, normalize_url
+from cassette import recorded
+from deadlines import retrying, time_left
+from metrics import count, span
+
+# Web search with a disk cache of results and concurrent multi-query fan-out.
+
+CACHE_TTL = 6 * 60 * 60
+MAX_QUERIES = 5
+RRF_K = 60
+TIMEOUT = 8
+
+
+class SearchBackend(Protocol):
+    def text(self, query: str, max_results: int) -> list[dict]:
+        '''
+        Results as dicts with "title", "url" and "snippet".
+        '''
+        ...
+
+
+class DDGSBackend:
+    '''
+    DuckDuckGo via ddgs, with one client per thread instead of one per query.
+    '''
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def text(self, query: str, max_results: int) -> list[dict]:
+        from ddgs.exceptions import RatelimitException, TimeoutException
+
+        if not hasattr(self._local, "ddgs"):
+            from ddgs import DDGS
+            self._local.ddgs = DDGS(timeout=TIMEOUT)
+
+        def search():
+            # ddgs has one timeout per client, so the deadline is only checked before every try
+            time_left(TIMEOUT)
+            return self._local.ddgs.text(query, max_results=max_results)
+
+        results = retrying(search, "duckduckgo.com", retry_on=(TimeoutException, RatelimitException)) or []
+        return [{"title": r.get("title", ""), "url": r.get("href", ""), "snippet": r.get("body", "")} for r in results]
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(re.sub(r"[^\w\s:.\-\"']", " ", query.lower()).split())
+
+
+class WebSearch:
+    '''
+    Cached searches shared by all sessions; several queries are run in parallel
+    and their results merged by reciprocal rank fusion.
+    '''
+
+    def __init__(self, backend: Optional[SearchBackend] = None, cache: Optional[DiskCache] = None, ttl: float = CACHE_TTL):
+        self.backend = backend or DDGSBackend()
+        self.cache = cache or DiskCache("search", max_bytes=20 * 1024 * 1024)
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=MAX_QUERIES, thread_name_prefix="search")
+
+    def search(self, query: str, max_results: int = 5) -> list[dict]:
+        key = f"{max_results}:{normalize_query(query)}"
+        entry = self.cache.get(key)
+        if entry is not None and entry.fresh:
+            count("search.cache_hits")
+            return json.loads(entry.value)
+        count("search.cache_misses")
+        with span("search", "fetch"):
+            results = recorded("search", key, functools.partial(self.backend.text, query, max_results))
+        self.cache.put(key, json.dumps(results), self.ttl)
+        return results
+
+    def search_many(self, queries: list[str], max_results: int = 5) -> list[dict]:
+        '''
+        Run up to MAX_QUERIES distinct queries concurrently and merge their results.
+        '''
+        unique = {}
+        for query in queries:
+            unique.setdefault(normalize_query(query), query)
+        unique.pop("", None)
+        unique = list(unique.values())[:MAX_QUERIES]
+        # Each query runs with the caller's context, so the caller's deadline applies
+        futures = [self._executor.submit(contextvars.copy_context().run, self.search, query, max_results) for query in unique]
+        scores: dict[str, float] = {}
+        merged: dict[str, dict] = {}
+        errors = []
+        for future in futures:
+            try:
+                results = future.result()
+            except Exception as e:
+                errors.append(e)
+                continue
+            for rank, result in enumerate(results):
+                key = normalize_url(result["url"]) if result.get("url") else result.get("title", "")
+                scores[key] = scores.get(key, 0.0) + 1 / (RRF_K + rank + 1)
+                merged.setdefault(key, result)
+        if errors and not merged:
+            raise errors[0]
+        ranked = sorted(merged, key=lambda key: scores[key], reverse=True)
+        return [merged[key] for key in ranked]
+
+
+_search: Optional[WebSearch] = None
+_search_lock = threading.Lock()
+
+
+def get_web_search() -> WebSearch:
+    global _search
+    with _search_lock:
+        if _search is None:
+            _search = WebSearch()
+        return _search
+
+
+def set_search_backend(backend: SearchBackend, cache: Optional[DiskCache] = None):
+    '''
+    Replace the search backend, e.g. by a local fake for offline runs.
+    '''
+    global _search
+    with _search_lock:
+        _search = WebSearch(backend, cache)
@@ -0,0 +1,112 @@
+import asyncio
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from cache import CACHE_DIR
+
+# One agent, workflow context and chat memory per Gradio session.
+
+MAX_LIVE_SESSIONS = int(os.getenv("MAX_LIVE_SESSIONS", "50"))
+IDLE_TIMEOUT = 30 * 60
+SESSIONS_DIR = os.path.join(CACHE_DIR, "sessions")
+
+
+@dataclass
+class Session:
+    id: str
+    agent: Any
+    ctx: Any
+    memory: Any
+    last_used: float = field(default_factory=time.time)
+    # Turns of one session run one after another
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+class SessionManager:
+    '''
+    Keeps at most `max_live` sessions in memory. The least recently used
+    sessions, and sessions idle for longer than `idle_timeout`, are written
+    to `store_dir` and restored from there when they come back.
+    `agent_factory` builds a fresh agent, `memory_factory` an empty memory.
+    '''
+
+    def __init__(self, agent_factory: Callable[[], Any], memory_factory: Callable[[], Any],
+                 max_live: int = MAX_LIVE_SESSIONS, idle_timeout: float = IDLE_TIMEOUT, store_dir: str = SESSIONS_DIR):
+        self.agent_factory = agent_factory
+        self.memory_factory = memory_factory
+        self.max_live = max_live
+        self.idle_timeout = idle_timeout
+        self.store_dir = store_dir
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.stats = {"created": 0, "restored": 0, "evicted": 0}
+        os.makedirs(store_dir, exist_ok=True)
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.store_dir, re.sub(r"[^\w-]", "_", session_id) + ".json")
+
+    def _new_session(self, session_id: str, messages: Optional[list] = None) -> Session:
+        from llama_index.core.llms import ChatMessage
+        from llama_index.core.workflow import Context
+
+        agent = self.agent_factory()
+        memory = self.memory_factory()
+        if messages:
+            memory.set([ChatMessage.model_validate(m) for m in messages])
+        return Session(session_id, agent, Context(agent), memory)
+
+    def get(self, session_id: str) -> Session:
+        session = self._sessions.get(session_id)
+        if session is None:
+            path = self._path(session_id)
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    session = self._new_session(session_id, json.load(f)["messages"])
+                os.remove(path)
+                self.stats["restored"] += 1
+            else:
+                session = self._new_session(session_id)
+                self.stats["created"] += 1
+            self._sessions[session_id] = session
+        session.last_used = time.time()
+        self._sessions.move_to_end(session_id)
+        self._evict()
+        return session
+
+    def _evict(self):
+        now = time.time()
+        # The most recently used session is the one being served
+        for session_id, session in list(self._sessions.items())[:-1]:
+            over_limit = len(self._sessions) > self.max_live
+            idle = now - session.last_used > self.idle_timeout
+            if not (over_limit or idle):
+                break
+            if session.lock.locked():
+                continue
+            self.persist(session)
+            del self._sessions[session_id]
+            self.stats["evicted"] += 1
+
+    def persist(self, session: Session):
+        messages = [m.model_dump(mode="json") for m in session.memory.get_all()]
+        if not messages:
+            return
+        tmp = self._path(session.id) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"id": session.id, "saved_at": time.time(), "messages": messages}, f, ensure_ascii=False)
+        os.replace(tmp, self._path(session.id))
+
+    def persist_all(self):
+        for session in self._sessions.values():
+            self.persist(session)
+
+    @property
+    def live(self) -> int:
+        return len(self._sessions)
+
+    def stored(self) -> int:
+        return sum(name.endswith(".json") for name in os.listdir(self.store_dir))
@@ -0,0 +1,48 @@
+from functools import lru_cache
+
+# Token counting with the tokenizer of the chat model (gpt-4o uses o200k_base).
+# Falls back to the usual four characters per token estimate when tiktoken
+# or its encoding files are not available.
+
+ENCODING = "o200k_base"
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(ENCODING)
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def encode(text: str) -> list:
+    '''
+    Token list of `text`, e.g. as tokenizer for llama_index's TokenCountingHandler.
+    '''
+    encoding = _encoding()
+    if encoding is None:
+        return [0] * count_tokens(text)
+    return encoding.encode(text, disallowed_special=())
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    '''
+    Cut `text` to at most `max_tokens` tokens.
+    '''
+    encoding = _encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
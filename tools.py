@@ -1,21 +1,66 @@
-from typing import Optional
-from llama_index.core.tools import FunctionTool
-from llama_index.core.schema import Document
-from playwright.sync_api import sync_playwright
-from ddgs import DDGS
-import requests
+from typing import Callable, List, Optional, Union
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime
-import json
+import contextvars
 import os
-from ics import Calendar, Event
-from llama_index.tools.duckduckgo import DuckDuckGoSearchToolSpec
+import threading
+import time
+from answer_cache import note_events, note_page
+from cache import get_page_cache
+from classifier import get_classifier
+from concurrency import offload, timed_out
+from deadlines import current_deadline, time_left
+from event_index import MAX_CATEGORIES, MAX_RESULTS, category_url, city_slug, find_events_in, format_event, rank_events, resolve_date
+from extraction import clean_text, select_chunks, format_chunks
+from fact_store import current_user, get_fact_store
+from fetch import fetch_page, find_link
+from metrics import annotate
+from observations import format_results, observation
+from search import get_web_search
+from weather import TIMEOUT, get_weather_service
 
-FACTS_FILE = 'facts.json'
+# llama_index, ddgs, ics and the browser are only imported when a tool is built
+# or first called, so importing this module is cheap. The *_tool() factories
+# register under their tool's name; get_tools() builds the FunctionTools once.
+
+_factories: dict[str, Callable] = {}
+_tools: dict[str, object] = {}
+_tools_lock = threading.Lock()
+
+
+def register_tool(name: str):
+    def register(factory: Callable) -> Callable:
+        _factories[name] = factory
+        return factory
+    return register
+
+
+def function_tool(fn: Callable, name: str, description: str):
+    '''
+    FunctionTool of the blocking `fn`, run on the tool thread pool when awaited.
+    '''
+    from llama_index.core.tools import FunctionTool
+
+    return FunctionTool.from_defaults(fn=fn, async_fn=offload(fn, name), name=name, description=description)
+
+
+def get_tools(names: Optional[List[str]] = None) -> list:
+    '''
+    The tools `names` (all registered ones by default), each built on first use and shared afterwards.
+    '''
+    with _tools_lock:
+        for name in names or _factories:
+            if name not in _tools:
+                _tools[name] = _factories[name]()
+        return [_tools[name] for name in names or _factories]
 
 def search_tool():
     '''
     Use DuckDuckGoSearchTool for web search.
     '''
+    from llama_index.core.tools import FunctionTool
+    from llama_index.tools.duckduckgo import DuckDuckGoSearchToolSpec
+
     tool_spec = DuckDuckGoSearchToolSpec()
     return FunctionTool.from_defaults(
         fn=tool_spec.duckduckgo_full_search,
@@ -24,181 +69,271 @@ def search_tool():
     )
 
 # Search tool
-def duckduckgo_search(query: str, max_results: int = 5) -> list[Document]:
-    documents = []
-    with DDGS() as ddgs:
-        results = ddgs.text(query, max_results=max_results)
-        for result in results:
-            content = result.get("body", "")
-            title = result.get("title", "")
-            url = result.get("href", "")
-            metadata = {"title": title, "url": url}
-            documents.append(Document(text=content, metadata=metadata))
-    return documents
+def duckduckgo_search(query: Union[str, List[str]], max_results: int = 5) -> str:
+    queries = [query] if isinstance(query, str) else query
+    results = get_web_search().search_many(queries, max_results=max_results)
+    limit = max_results if len(queries) == 1 else max_results + 3
+    return observation(format_results(results[:limit]), "duckduckgo_websearch", raw=str(results))
 
+@register_tool("duckduckgo_websearch")
 def duckduckgo_tool():
     """
     Search the Web with DuckDuckGo
     """
-    return FunctionTool.from_defaults(
-        fn=duckduckgo_search,
-        name="duckduckgo_websearch",
+    return function_tool(
+        duckduckgo_search,
+        "duckduckgo_websearch",
         description="Use this to answer factual questions about public figures, dates, countries, laws, or historical facts. Do not guess. Return a short fact and source URL."
-                    "Search for relevant web pages based on a query. Returns a list of search results with title, body and URL.",
+                    "Search for relevant web pages based on a query. Returns a numbered list of search results with title, URL and a short snippet. "
+                    "query can also be a list of up to 5 differently phrased queries, they are searched at the same time and the results are merged into one ranked list.",
     )
 # Date
 def get_date():
     now = datetime.now()
-    return now.strftime("%Y-%m-%d %H:%M:%S")
+    return observation(now.strftime("%Y-%m-%d %H:%M:%S"), "GetDateandTime")
 
+@register_tool("GetDateandTime")
 def date_tool():
     '''
     Get current date and time.
     '''
-    return FunctionTool.from_defaults(
-        fn=get_date,
-        name="GetDateandTime",
-        description="Get current date and time for an answer in YYYY-MM-DD H:M:S format."
+    return function_tool(
+        get_date,
+        "GetDateandTime",
+        description="Get current date and time for an answer in YYYY-MM-DD H:M:S format.",
     )
 # Weather Tool
 def get_weather(city: str) -> str:
     # Use wttr.in, simple web page for the weather forecast of next 3 days
     try:
-        response = requests.get(f"https://wttr.in/{city}", timeout=10)
-        response.raise_for_status()
-        return "Observation: " + response.text.strip() + "\n"
+        return observation(get_weather_service().forecast(city), "GetWeather")
+    except TimeoutError:
+        deadline = current_deadline.get()
+        return timed_out("GetWeather", deadline.seconds if deadline else TIMEOUT)
     except Exception as e:
-        return "Observation: " + f"An error occurred: {e}" + "\n"
+        return observation(f"An error occurred: {e}", "GetWeather")
 
+@register_tool("GetWeather")
 def weather_tool():
     '''
     Get the weather forcast for the next 3 days for a city.
     '''
-    return FunctionTool.from_defaults(
-        fn=get_weather,
-        name="GetWeather",
+    return function_tool(
+        get_weather,
+        "GetWeather",
         description="Use this tool for outdoor activities to get the weather forcast for the next 3 days for a given city. "
-                    "Input is a city name string."
+                    "Input is a city name string. Returns temperature, weather, chance of rain and wind for the morning, noon, evening and night of each day.",
     )
 
-def summarize_webpage(url: str) -> str:
+def read_webpage(url: str, timeout: Optional[float] = None) -> str:
+    """
+    Main text of a webpage without navigation, banners and footers.
+    Repeated reads are served from the page cache.
+    """
+    cache = get_page_cache()
+    text = cache.lookup(url)
+    annotate(page_cache="hit" if text is not None else "miss")
+    if text is None:
+        page = fetch_page(url, timeout)
+        text = clean_text(page.text)
+        cache.store(url, text, page.headers)
+    note_page(url)
+    return text
+
+def page_passages(url: str, query: Optional[str] = None, max_tokens: int = 1500, timeout: Optional[float] = None) -> tuple[str, str]:
+    """
+    The passages of the page most relevant to the query, formatted, and the page's full main text.
+    """
+    text = read_webpage(url, timeout)
+    chunks = select_chunks(text, query, max_tokens=max_tokens)
+    return format_chunks(url, text, chunks), text
+
+def summarize_webpage(url: str, query: Optional[str] = None, max_tokens: int = 1500) -> str:
     """
-    Loads a webpage using Playwright and returns its inner text content.
+    Loads a webpage and returns the passages most relevant to the query.
     """
-    with sync_playwright() as playwright:
-        chromium = playwright.chromium
-        browser = chromium.launch(headless=False)
-        page = browser.new_page()
-        page.goto(url)
-        text = page.inner_text("body")
-        browser.close()
-        return "Observation: " + text + "\n"
+    passages, text = page_passages(url, query, max_tokens)
+    return observation(passages, "ExtractAndReadWebPage", raw=text)
 
+@register_tool("ExtractAndReadWebPage")
 def summarize_webpage_tool():
     '''
-    Extract the content of a webpage using Playwright and returns its inner text content.
+    Extract the content of a webpage and return the most relevant passages.
     '''
-    return FunctionTool.from_defaults(
-        fn=summarize_webpage,
-        name="ExtractAndReadWebPage",
+    return function_tool(
+        summarize_webpage,
+        "ExtractAndReadWebPage",
         description=(
-            "Use this tool to extract and summarize the full content of a webpage. "
-            "Provide a URL, and it will return the full text content from the page's body."
-        )
+            "Use this tool to extract and read the content of a webpage. "
+            "Provide a URL and optionally a query describing what you are looking for (e.g. 'party tonight price location'). "
+            "It returns the passages of the page's main content that match the query best, each with its character offsets in the page. "
+            "Without a query it returns the beginning of the page. max_tokens limits the size of the result (default 1500)."
+        ),
     )
 
-def get_category_examples() -> str:
-    # Read json-file with examples of events taken from rausgegangen.de
-    with open("example_categories.json", "r") as f:
-        category_examples = json.load(f)
-    return "Observation: " + str(category_examples) + "\n"
+# Pages read by one ReadWebPages call, and the seconds each of them may take
+MAX_PAGES_PER_READ = 5
+PAGE_DEADLINE = 20
+_page_readers = ThreadPoolExecutor(max_workers=2 * MAX_PAGES_PER_READ, thread_name_prefix="pages")
+
+def read_webpages(urls: List[str], query: Optional[str] = None, max_tokens: int = 3000) -> str:
+    """
+    Reads several webpages at the same time and returns the passages most relevant to the query for each of them.
+    """
+    urls = list(dict.fromkeys(url.strip() for url in urls if url.strip()))[:MAX_PAGES_PER_READ]
+    if not urls:
+        return observation("No URL given.", "ReadWebPages")
+    # The token budget is shared by the pages
+    budget = max(200, max_tokens // len(urls))
+    seconds = time_left(PAGE_DEADLINE)
+    deadline = time.monotonic() + seconds
+    # The pages are read with this call's context, so its deadline applies to them
+    futures = {url: _page_readers.submit(contextvars.copy_context().run, page_passages, url, query, budget, seconds)
+               for url in urls}
+
+    sections, raw = [], []
+    for n, (url, future) in enumerate(futures.items(), 1):
+        try:
+            passages, text = future.result(timeout=max(0, deadline - time.monotonic()))
+            sections.append(f"[{n}] {passages}")
+            raw.append(text)
+        except FutureTimeoutError:
+            future.cancel()
+            sections.append(f"[{n}] {url} - timed out after {seconds:.0f} s")
+        except Exception as e:
+            sections.append(f"[{n}] {url} - could not be read: {e}")
+    return observation("\n\n---\n\n".join(sections), "ReadWebPages", raw="\n\n".join(raw))
+
+@register_tool("ReadWebPages")
+def read_webpages_tool():
+    '''
+    Read several webpages in parallel.
+    '''
+    return function_tool(
+        read_webpages,
+        "ReadWebPages",
+        description=(
+            f"Use this tool to read up to {MAX_PAGES_PER_READ} webpages at once, e.g. the most promising search results or events. "
+            "Provide a list of URLs and optionally a query describing what you are looking for. "
+            "It returns one section per URL with the passages of the page that match the query best. "
+            "Pages that fail or take too long are reported as such. max_tokens limits the size of the whole result (default 3000)."
+        ),
+    )
+
+def classify_query(query: str) -> str:
+    # Local classifier built from example_categories.json (examples of events taken from rausgegangen.de)
+    ranked = get_classifier().classify(query, top_k=3)
+    categories = ", ".join(f"{category} ({confidence:.2f})" for category, confidence in ranked)
+    return observation(f"Best matching categories: {categories}", "ClassifyQuery")
 
 
+@register_tool("ClassifyQuery")
 def classify_query_tool():
     '''
     Classify an event in one of the rausgegangen.de categories.
     '''
-    return FunctionTool.from_defaults(
-        fn=get_category_examples,
-        name="ClassifyQuery",
-        description="Use this tool to get a dictionary with examples for each category"
-                    "Classify the users query as one of the following categories: party, konzerte-und-musik, markt, theater, shows-und-performances, ausstellung, gesprochenes, food-und-drinks, aktiv-und-kreativ, feste-und-festival, sport, film or kinder-und-familien."
-        ,
+    return function_tool(
+        classify_query,
+        "ClassifyQuery",
+        description="Use this tool to classify the users query as one of the rausgegangen.de categories: party, konzerte-und-musik, markt, theater, shows-und-performances, ausstellung, gesprochenes, food-und-drinks, aktiv-und-kreativ, feste-und-festival, sport, film or kinder-und-familien. "
+                    "Input is a short description of the activity. Returns the three best matching categories with a confidence between 0 and 1.",
     )
 
-def browse_rausgegangen_de_categories(city:str, category: str,) -> str:
-    url= f"https://rausgegangen.de/{city}/kategorie/{category}"
-    print(url)
-    return "Observation: " + url + "\n"
+# Categories browsed for category="auto"
+AUTO_CATEGORIES = 3
+
+def browse_rausgegangen_de_categories(city: str, category: Union[str, List[str]] = "auto", date: str = "today", query: Optional[str] = None) -> str:
+    try:
+        day = resolve_date(date)
+    except ValueError:
+        return observation(f"Invalid date '{date}', use 'today', 'tomorrow' or YYYY-MM-DD.", "BrowseRausgegangenDeCategories")
+    categories = category if isinstance(category, list) else category.split(",")
+    if [c.strip().lower() for c in categories] == ["auto"]:
+        if not query:
+            return observation("category 'auto' needs a query describing what the user is looking for.", "BrowseRausgegangenDeCategories")
+        categories = [c for c, _ in get_classifier().classify(query, top_k=AUTO_CATEGORIES)]
+    categories = [c.strip().lower() for c in categories if c.strip()][:MAX_CATEGORIES]
+    if not categories:
+        return observation("No category given.", "BrowseRausgegangenDeCategories")
 
+    events, errors = find_events_in(city, categories, day)
+    for c in categories:
+        note_events(city_slug(city), c, day)
+    events = rank_events(events, query)
+    names = ", ".join(categories)
+    sources = "Category pages: " + ", ".join(category_url(city, c) for c in categories)
+    failed = [f"Could not read {c}: {error}" for c, error in errors.items()]
+    if not events:
+        return observation("\n".join([f"No events found for {names} in {city} on {day}."] + failed + [sources]), "BrowseRausgegangenDeCategories")
+    order = f", best matches for '{query}' first" if query else ""
+    lines = [f"{len(events)} events for {names} in {city} on {day}{order} (name | date time | venue | price | category | url)"]
+    lines += [format_event(i, event, with_category=True) for i, event in enumerate(events[:MAX_RESULTS], 1)]
+    return observation("\n".join(lines + failed + [sources]), "BrowseRausgegangenDeCategories")
+
+@register_tool("BrowseRausgegangenDeCategories")
 def browse_rausgegangen_de_categories_tool():
     '''
-    Browse the rausgegangen.de, the urls have a defined structure.
+    Browse the rausgegangen.de event index by city, categories and date.
     '''
-    return FunctionTool.from_defaults(
-        fn=browse_rausgegangen_de_categories,
-        name="BrowseRausgegangenDeCategories",
+    return function_tool(
+        browse_rausgegangen_de_categories,
+        "BrowseRausgegangenDeCategories",
         description=(
-            "Return the url link of the website."
-            "The input parameter are: city name in english in small letters, and one of the given categories."
+            "Return the events of rausgegangen.de categories in a city with name, date, start time, venue, price, category and event url. "
+            "The input parameter are: city name in small letters, "
+            f"category: one of the given categories, a list of up to {MAX_CATEGORIES} of them, or 'auto' for the {AUTO_CATEGORIES} categories that fit the query best, "
+            "the date ('today', 'tomorrow' or YYYY-MM-DD, default today) "
+            "and a query describing what the user is looking for (e.g. 'techno party'), which ranks the events and is required for 'auto'. "
+            "All categories are searched at once and the events are merged. "
             "Use this tool only for german cities!"
-        )
+        ),
     )
 
 def more_information_rausgegangen_event(url:str, event_name:str) -> str:
-    with sync_playwright() as playwright:
-        browser = playwright.chromium.launch(headless=False)
-        context = browser.new_context()
-        # create a new page inside context.
-        page = context.new_page()
-        page.goto(url)
-        page.get_by_role("link", name=event_name).click()
-        context.close()
-        return "Observation: " + page.url + "\n"
+    # The event link is looked up in the category page's HTML instead of clicked
+    page = fetch_page(url)
+    event_url = find_link(page.html, page.url, event_name)
+    if event_url is None and page.tier == "http":
+        page = fetch_page(url, use_http=False)
+        event_url = find_link(page.html, page.url, event_name)
+    if event_url is None:
+        return observation(f"No link to '{event_name}' found on {url}.", "Extract_Event_URL")
+    return observation(event_url, "Extract_Event_URL")
 
+@register_tool("Extract_Event_URL")
 def more_information_tool():
-    return FunctionTool.from_defaults(
-        fn=more_information_rausgegangen_event,
-        name="Extract_Event_URL",
+    return function_tool(
+        more_information_rausgegangen_event,
+        "Extract_Event_URL",
         description=("Use this tool to get an url about one event. As input it gets the url of the category website and the name of the event."
-                     "It only returns the link of the website.")
+                     "It only returns the link of the website."),
     )
 
-def load_facts():
-    if not os.path.exists(FACTS_FILE):
-        return []
-    with open(FACTS_FILE, "r") as f:
-        return json.load(f)
-
-
 def store_fact(new_fact: str) -> str:
-    facts = load_facts()
-    if new_fact in facts:
-        return "Observation: " + f"Fact '{new_fact}' was already stored." + "\n"
-    else:
-        facts.append(new_fact)
-        with open(FACTS_FILE, "w") as f:
-            json.dump(facts, f)
-        return "Observation: " + f"Fact stored: {new_fact}" + "\n"
-
+    if get_fact_store().add(new_fact, current_user.get()):
+        return observation(f"Fact stored: {new_fact}", "StoreFact")
+    return observation(f"Fact '{new_fact}' was already stored.", "StoreFact")
 
+@register_tool("StoreFact")
 def store_fact_tool():
     '''
-    Store facts about the user in a json file.
+    Store facts about the user in the fact store.
     '''
-    return FunctionTool.from_defaults(
-        fn=store_fact,
-        name="StoreFact",
+    return function_tool(
+        store_fact,
+        "StoreFact",
         description="""
       Use this tool to store a fact about the user.
       The fact is supplied as a string and stored for future use.
       This tool returns the fact that was stored.
-    """
+    """,
     )
 
 #CalendarTool
 # Create a .ics file of the event to export it to a calendar
 def create_ics_event(name:str, date:str, time:str, location:Optional[str] = None, url:Optional[str] = None) -> str:
+    from ics import Calendar, Event
+
     c = Calendar()
     e = Event()
     e.name = name
@@ -212,18 +347,23 @@ def create_ics_event(name:str, date:str, time:str, location:Optional[str] = None
     os.makedirs(os.path.dirname(path), exist_ok=True)
     with open(path, 'w') as f:
         f.writelines(c.serialize_iter())
-    return "Observation: " + f"{path}" + "\n"
+    return observation(f"{path}", "CreateICSEvent")
 
+@register_tool("CreateICSEvent")
 def create_ics_tool():
     '''
     Create a calendar entry of an event. Name, date and time are mandatory. location, url are optional.
     '''
-    return FunctionTool.from_defaults(
-        fn=create_ics_event,
-        name="CreateICSEvent",
+    return function_tool(
+        create_ics_event,
+        "CreateICSEvent",
         description="Create an .ics file. with a calendar entry. "
                     "It takes event name, date and starting time of the event as input. The location of the event and the url of the event are optional inputs. "
-                    "It returns the path of the file."
+                    "It returns the path of the file.",
     )
 
 
+
+# The tools of the event agent and the GAIA agent, in prompt order
+AGENT_TOOLS = ["duckduckgo_websearch", "ExtractAndReadWebPage", "ReadWebPages", "GetWeather", "GetDateandTime",
+               "BrowseRausgegangenDeCategories", "ClassifyQuery", "StoreFact", "CreateICSEvent", "Extract_Event_URL"]
@@ -0,0 +1,143 @@
+import functools
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Optional, Protocol
+from urllib.parse import quote
+
+import requests
+
+from cassette import recorded
+from deadlines import current_deadline, retrying, time_left
+from metrics import annotate
+
+# Weather forecasts from wttr.in as a few compact lines.
+
+WEATHER_URL = os.getenv("WEATHER_URL", "https://wttr.in")
+CACHE_TTL = 30 * 60
+TIMEOUT = 6
+
+# wttr.in reports every three hours, these are the slots we show
+PERIODS = {"900": "morning", "1200": "noon", "1800": "evening", "2100": "night"}
+
+
+class WeatherBackend(Protocol):
+    def fetch(self, city: str) -> dict:
+        '''
+        Forecast for `city` in wttr.in's j1 JSON format.
+        '''
+        ...
+
+
+class WttrBackend:
+    '''
+    wttr.in (or anything serving its j1 format, e.g. a local stub server) over a pooled session.
+    '''
+
+    def __init__(self, base_url: str = WEATHER_URL, session: Optional[requests.Session] = None):
+        self.base_url = base_url.rstrip("/")
+        self.session = session or requests.Session()
+
+    def fetch(self, city: str) -> dict:
+        def get():
+            response = self.session.get(f"{self.base_url}/{quote(city)}", params={"format": "j1"}, timeout=time_left(TIMEOUT))
+            response.raise_for_status()
+            return response
+
+        return retrying(get, self.base_url, retry_on=(requests.ConnectionError, requests.Timeout)).json()
+
+
+def _value(entry: dict, key: str) -> str:
+    # weatherDesc and areaName are lists of {"value": ...}
+    items = entry.get(key) or [{}]
+    return items[0].get("value", "").strip()
+
+
+def format_forecast(city: str, data: dict) -> str:
+    area = _value((data.get("nearest_area") or [{}])[0], "areaName") or city
+    lines = [f"Weather for {area}:"]
+    current = (data.get("current_condition") or [None])[0]
+    if current:
+        lines.append(f"now: {current.get('temp_C')}°C (feels {current.get('FeelsLikeC')}°C), "
+                     f"{_value(current, 'weatherDesc')}, wind {current.get('windspeedKmph')} km/h")
+    for day in data.get("weather", []):
+        periods = []
+        for hour in day.get("hourly", []):
+            name = PERIODS.get(hour.get("time"))
+            if name:
+                periods.append(f"{name} {hour.get('tempC')}°C {_value(hour, 'weatherDesc')}, "
+                               f"rain {hour.get('chanceofrain')}%, wind {hour.get('windspeedKmph')} km/h")
+        lines.append(f"{day.get('date')}: {day.get('mintempC')}-{day.get('maxtempC')}°C; " + "; ".join(periods))
+    return "\n".join(lines)
+
+
+class WeatherService:
+    '''
+    Forecast lookups with a per-city cache. Concurrent lookups of the same city
+    share a single backend request.
+    '''
+
+    def __init__(self, backend: Optional[WeatherBackend] = None, ttl: float = CACHE_TTL):
+        self.backend = backend or WttrBackend()
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._cache: dict[str, tuple[float, str]] = {}
+        self._inflight: dict[str, Future] = {}
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0}
+
+    def forecast(self, city: str) -> str:
+        key = " ".join(city.lower().split())
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] > time.time():
+                self.stats["hits"] += 1
+                annotate(weather_cache="hit")
+                return cached[1]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+                self.stats["misses"] += 1
+            else:
+                self.stats["coalesced"] += 1
+        annotate(weather_cache="miss" if owner else "coalesced")
+        if not owner:
+            # The fetching caller's request ends within its budget; only this caller's own deadline
+            # cuts the wait short (a TimeoutError, reported by the tool as "timed out")
+            deadline = current_deadline.get()
+            return future.result(time_left(deadline.seconds) if deadline else None)
+        try:
+            result = format_forecast(city, recorded("weather", key, functools.partial(self.backend.fetch, city)))
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            with self._lock:
+                self._cache[key] = (time.time() + self.ttl, result)
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+
+_service: Optional[WeatherService] = None
+_service_lock = threading.Lock()
+
+
+def get_weather_service() -> WeatherService:
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = WeatherService()
+        return _service
+
+
+def set_weather_backend(backend: WeatherBackend, ttl: float = CACHE_TTL):
+    '''
+    Replace the backend, e.g. by a WttrBackend pointing at a local stub server in tests.
+    '''
+    global _service
+    with _service_lock:
+        _service = WeatherService(backend, ttl)